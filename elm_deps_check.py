@@ -4,6 +4,9 @@ from __future__ import print_function
 import sys
 import json
 import argparse
+from collections import OrderedDict
+
+import stamps
 
 
 def have_matching_versions(top_level_file, spec_file, is_exact=False, quiet=True):
@@ -11,15 +14,8 @@ def have_matching_versions(top_level_file, spec_file, is_exact=False, quiet=True
         second file should be the spec file
     """
 
-    with open(top_level_file) as f:
-        top_level = json.load(f)
-
-    with open(spec_file) as f:
-        spec = json.load(f)
-
-    if not is_exact:
-        top_level = top_level['dependencies']
-        spec = spec['dependencies']
+    top_level = load_deps(top_level_file, is_exact)
+    spec = load_deps(spec_file, is_exact)
 
     if not quiet:
         print(top_level_file, json.dumps(top_level, sort_keys=True, indent=4))
@@ -47,6 +43,63 @@ def have_matching_versions(top_level_file, spec_file, is_exact=False, quiet=True
         print('Matching deps!')
         return True
 
+def load_deps(filename, is_exact=False):
+    with open(filename) as f:
+        data = json.load(f)
+
+    return data if is_exact else data['dependencies']
+
+
+def index_versions(files_deps):
+    """ builds package -> {version -> [files]} from (file, deps) pairs in a single pass
+    >>> index = index_versions([('a.json', {'elm-lang/core': '5.0.0'}), ('b.json', {'elm-lang/core': '5.1.1'})])
+    >>> index['elm-lang/core'] == {'5.0.0': ['a.json'], '5.1.1': ['b.json']}
+    True
+    """
+    index = OrderedDict()
+
+    for (filename, deps) in files_deps:
+        for (package_name, package_version) in deps.items():
+            index.setdefault(package_name, OrderedDict()).setdefault(package_version, []).append(filename)
+
+    return index
+
+
+def have_consistent_versions(files, is_exact=False, quiet=True):
+    """ every file must agree on the version of each package they have in common.
+        Unlike have_matching_versions, a package missing from some files is fine.
+    """
+
+    files_deps = [(filename, load_deps(filename, is_exact)) for filename in files]
+
+    if not quiet:
+        for (filename, deps) in files_deps:
+            print(filename, json.dumps(deps, sort_keys=True, indent=4))
+
+    errors = []
+
+    for (package_name, versions) in sorted(index_versions(files_deps).items()):
+        if len(versions) < 2:
+            continue
+
+        errors.append('Package version mismatch for {package_name}!\n\n{details}'.format(
+            package_name=package_name,
+            details='\n'.join(
+                ' {filename} had {package_version}'.format(filename=filename, package_version=package_version)
+                for (package_version, filenames) in versions.items()
+                for filename in filenames
+            )
+        ))
+
+    if len(errors) > 0:
+        print('BUILD FAILED due to elm-deps mismatch, errors:')
+        print('\n'.join(errors))
+        return False
+    else:
+        print('Matching deps!')
+        return True
+
+
 def main():
 
     parser = argparse.ArgumentParser(description='Check deps matching between a parent and a sub')
@@ -54,13 +107,48 @@ def main():
     parser.add_argument('--quiet', '-q', action='store_true', help='don\'t print anything', default=False)
     parser.add_argument('--exact', '-e', action='store_true', help='these files are exact dependencies', default=False)
 
-    parser.add_argument('top_level_file')
-    parser.add_argument('spec_file')
+    parser.add_argument('--workspace', '-w',
+        action='store_true',
+        help='check that any number of files agree on the versions they share',
+        default=False
+    )
+
+    parser.add_argument('--no-stamp',
+        action='store_true',
+        help='check even if the files haven\'t changed since they last matched',
+        default=False
+    )
+
+    parser.add_argument('files', nargs='+', metavar='file', help='the top level file then the spec file, or with --workspace any number of files')
     args = parser.parse_args()
 
-    if not have_matching_versions(args.top_level_file, args.spec_file, quiet=args.quiet, is_exact=args.exact):
+    stamp_options = ['exact' if args.exact else 'package', 'workspace' if args.workspace else 'pair']
+    contents = None
+
+    if not args.no_stamp:
+        try:
+            contents = stamps.contents_hash(args.files)
+        except (IOError, OSError):
+            pass
+
+    # without --quiet the deps are printed, so the files have to be read anyway
+    if contents and args.quiet and stamps.is_fresh('elm_deps_check', args.files, stamp_options, contents=contents):
+        print('Matching deps!')
+        return
+
+    if args.workspace:
+        matching = have_consistent_versions(args.files, quiet=args.quiet, is_exact=args.exact)
+    elif len(args.files) == 2:
+        matching = have_matching_versions(args.files[0], args.files[1], quiet=args.quiet, is_exact=args.exact)
+    else:
+        parser.error('expected a top level file and a spec file, use --workspace to check more')
+
+    if not matching:
         sys.exit(1)
 
+    if contents:
+        stamps.record('elm_deps_check', args.files, stamp_options, contents=contents)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,316 @@
+#! /usr/bin/env python
+"""
+Resolve the constraints in elm-package.json to exact versions, without elm-package.
+
+Resolution runs against a registry snapshot: a JSON file mapping each package
+to its versions, and each version to the dependencies in its elm-package.json:
+
+    {
+        "elm-lang/html": {
+            "2.0.0": {
+                "elm-lang/core": "5.0.0 <= v < 6.0.0",
+                "elm-lang/virtual-dom": "2.0.0 <= v < 3.0.0"
+            }
+        }
+    }
+
+With --update-snapshot, anything the snapshot is missing is fetched from the
+registry as the resolver needs it, and the snapshot is saved for next time.
+"""
+from __future__ import print_function
+
+# from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import sys
+
+import elm_deps_upgrade as upgrader
+import elm_package
+import exact_dependencies
+
+
+def parse_constraint(constraint):
+    # type: (str) -> Tuple[Tuple[int, ...], bool, Tuple[int, ...], bool]
+    """
+    Returns (lower, lower is inclusive, upper, upper is inclusive).
+    >>> parse_constraint('1.0.0 <= v < 2.0.0')
+    ((1, 0, 0), True, (2, 0, 0), False)
+    >>> parse_constraint('1.2.1 <= v <= 1.2.1')
+    ((1, 2, 1), True, (1, 2, 1), True)
+    """
+    (lower, lower_op, _, upper_op, upper) = constraint.split()
+    return (upgrader.parse_version(lower), lower_op == '<=', upgrader.parse_version(upper), upper_op == '<=')
+
+
+def satisfies(version, constraint):
+    # type: (str, str) -> bool
+    """
+    >>> satisfies('1.9.0', '1.0.0 <= v < 2.0.0')
+    True
+    >>> satisfies('2.0.0', '1.0.0 <= v < 2.0.0')
+    False
+    >>> satisfies('1.0.0', '1.0.0 < v <= 2.0.0')
+    False
+    """
+    (lower, lower_inclusive, upper, upper_inclusive) = parse_constraint(constraint)
+    parsed = upgrader.parse_version(version)
+
+    above_lower = parsed >= lower if lower_inclusive else parsed > lower
+    below_upper = parsed <= upper if upper_inclusive else parsed < upper
+
+    return above_lower and below_upper
+
+
+class SnapshotSource(object):
+    """ Answers the resolver's questions from a registry snapshot. """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def versions(self, name):
+        # type: (str) -> List[str]
+        return list(self.snapshot.get(name, {}))
+
+    def dependencies(self, name, version):
+        # type: (str, str) -> Dict[str, str]
+        dependencies = self.snapshot[name][version]
+
+        if dependencies is None:
+            raise Exception('The snapshot has no dependencies for {name} {version}, try --update-snapshot'.format(
+                name=name, version=version))
+
+        return dependencies
+
+
+class RegistrySource(SnapshotSource):
+    """ Fills in the snapshot from the registry, as the resolver asks for things it is missing. """
+
+    def __init__(self, snapshot, elm_version, url=None):
+        SnapshotSource.__init__(self, snapshot)
+        self.elm_version = elm_version
+        self.url = url or "http://package.elm-lang.org/packages/"
+        self.all_packages = None
+
+    def versions(self, name):
+        if name not in self.snapshot:
+            if self.all_packages is None:
+                self.all_packages = upgrader.load_all_packages(self.elm_version)
+
+            versions = self.all_packages.get(name, {}).get('versions', [])
+            self.snapshot[name] = dict((version, None) for version in versions)
+
+        return SnapshotSource.versions(self, name)
+
+    def dependencies(self, name, version):
+        if self.snapshot[name].get(version) is None:
+            manifest = upgrader.cached_registry_get(
+                '{url}{name}/{version}/elm-package.json'.format(url=self.url, name=name, version=version),
+                'elm-package-{name}-{version}'.format(name=name.replace('/', '--'), version=version)
+            )
+            self.snapshot[name][version] = manifest.get('dependencies', {})
+
+        return SnapshotSource.dependencies(self, name, version)
+
+
+def resolve(direct_deps, source):
+    # type: (Dict[str, str], SnapshotSource) -> Optional[Dict[str, str]]
+    """
+    Picks a version of every package reachable from direct_deps such that every
+    constraint holds, trying newer versions first.
+    Returns None if there is no such set of versions.
+
+    The package decided next is always the one with the fewest versions left,
+    and sets of choices that have already failed are remembered, so no dead end
+    is explored twice.
+
+    >>> snapshot = {
+    ...     'a/app': {
+    ...         '1.0.0': {'b/lib': '1.0.0 <= v < 2.0.0'},
+    ...         '2.0.0': {'b/lib': '2.0.0 <= v < 3.0.0'},
+    ...     },
+    ...     'b/lib': {'1.0.0': {}, '2.0.0': {}},
+    ... }
+    >>> resolve({'a/app': '1.0.0 <= v < 3.0.0', 'b/lib': '1.0.0 <= v < 2.0.0'}, SnapshotSource(snapshot)) \
+        == {'a/app': '1.0.0', 'b/lib': '1.0.0'}
+    True
+    >>> resolve({'a/app': '2.0.0 <= v < 3.0.0', 'b/lib': '1.0.0 <= v < 2.0.0'}, SnapshotSource(snapshot)) is None
+    True
+    """
+    failed = set()
+    sorted_versions = {}
+
+    def versions_newest_first(name):
+        if name not in sorted_versions:
+            sorted_versions[name] = sorted(source.versions(name), key=upgrader.parse_version, reverse=True)
+        return sorted_versions[name]
+
+    def constraints_on(chosen):
+        constraints = dict((name, [constraint]) for (name, constraint) in direct_deps.items())
+
+        for (name, version) in chosen.items():
+            for (dep, constraint) in source.dependencies(name, version).items():
+                constraints.setdefault(dep, []).append(constraint)
+
+        return constraints
+
+    def search(chosen):
+        key = frozenset(chosen.items())
+        if key in failed:
+            return None
+
+        constraints = constraints_on(chosen)
+        undecided = sorted(name for name in constraints if name not in chosen)
+
+        if not undecided:
+            return chosen
+
+        candidates_by_name = dict(
+            (name, [
+                version for version in versions_newest_first(name)
+                if all(satisfies(version, constraint) for constraint in constraints[name])
+            ])
+            for name in undecided
+        )
+        name = min(undecided, key=lambda name: len(candidates_by_name[name]))
+
+        for version in candidates_by_name[name]:
+            deps = source.dependencies(name, version)
+
+            if any(dep in chosen and not satisfies(chosen[dep], constraint) for (dep, constraint) in deps.items()):
+                continue
+
+            next_chosen = dict(chosen)
+            next_chosen[name] = version
+
+            result = search(next_chosen)
+            if result is not None:
+                return result
+
+        failed.add(key)
+        return None
+
+    return search({})
+
+
+def load_snapshot(path):
+    # type: (str) -> Dict
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+
+def save_snapshot(path, snapshot):
+    # type: (str, Dict) -> None
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+
+    elm_package.write_atomically(path, json.dumps(snapshot, sort_keys=True, indent=4, separators=(',', ': ')))
+
+
+def default_snapshot_path(elm_version):
+    # type: (str) -> str
+    cache_dir = upgrader.REGISTRY_CACHE_DIR or upgrader.default_registry_cache_dir()
+    return os.path.join(cache_dir, 'snapshot-{elm_version}.json'.format(elm_version=elm_version))
+
+
+def resolve_elm_package(elm_package_file, snapshot_path, elm_version='0.18', update_snapshot=False):
+    # type: (str, str, str, bool) -> Optional[Dict[str, str]]
+    with open(elm_package_file) as f:
+        direct_deps = elm_package.load(f)['dependencies']
+
+    snapshot = load_snapshot(snapshot_path)
+
+    if update_snapshot:
+        source = RegistrySource(snapshot, elm_version)
+    else:
+        source = SnapshotSource(snapshot)
+
+    try:
+        return resolve(direct_deps, source)
+    finally:
+        if update_snapshot:
+            save_snapshot(snapshot_path, snapshot)
+
+
+def check_exact_dependencies(resolved, exact_deps_file):
+    # type: (Dict[str, str], str) -> List[str]
+    """ the differences between the resolved versions and an existing exact-dependencies.json """
+    try:
+        with open(exact_deps_file) as f:
+            existing = exact_dependencies.load(f)
+    except IOError:
+        existing = {}
+
+    errors = []
+
+    for name in sorted(set(resolved) | set(existing)):
+        if name not in existing:
+            errors.append('{name} {version} is missing from {file}'.format(
+                name=name, version=resolved[name], file=exact_deps_file))
+        elif name not in resolved:
+            errors.append('{name} is in {file} but nothing depends on it'.format(name=name, file=exact_deps_file))
+        elif existing[name] != resolved[name]:
+            errors.append('{name} resolves to {version}, but {file} has {existing}'.format(
+                name=name, version=resolved[name], file=exact_deps_file, existing=existing[name]))
+
+    return errors
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Resolve elm-package.json to exact-dependencies.json offline')
+
+    parser.add_argument('--elm-version', help='specify your current elm version', default='0.18')
+    parser.add_argument('--snapshot', help='the registry snapshot to resolve against. Defaults to one in the registry cache')
+    parser.add_argument('--update-snapshot',
+        action='store_true',
+        help='fetch whatever the snapshot is missing from the registry',
+        default=False
+    )
+    parser.add_argument('--output', '-o', help='where to write exact-dependencies.json. Defaults to elm-stuff next to elm-package.json')
+    parser.add_argument('--check', action='store_true', help='only check that the existing file matches', default=False)
+
+    parser.add_argument('elm_package')
+    args = parser.parse_args()
+
+    snapshot_path = args.snapshot or default_snapshot_path(args.elm_version)
+    output = args.output or os.path.join(
+        os.path.dirname(args.elm_package), 'elm-stuff', 'exact-dependencies.json')
+
+    resolved = resolve_elm_package(
+        args.elm_package, snapshot_path, elm_version=args.elm_version, update_snapshot=args.update_snapshot)
+
+    if resolved is None:
+        print('No set of versions satisfies the dependencies in {file}'.format(file=args.elm_package))
+        sys.exit(1)
+
+    if args.check:
+        errors = check_exact_dependencies(resolved, output)
+        if errors:
+            print('\n'.join(errors))
+            sys.exit(1)
+        print('{file} is up to date.'.format(file=output))
+        return
+
+    try:
+        os.makedirs(os.path.dirname(output))
+    except OSError:
+        pass
+
+    exact_deps = elm_package.ElmPackage.open(output, exact=True, missing_ok=True)
+    exact_deps.replace(resolved)
+
+    if not exact_deps.save():
+        print('{file} is up to date.'.format(file=output))
+        return
+
+    print('Wrote {number} packages to {file}'.format(number=len(resolved), file=output))
+
+
+if __name__ == '__main__':
+    main()
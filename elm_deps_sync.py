@@ -3,21 +3,14 @@ from __future__ import print_function
 
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import elm_package
+import stamps
 
 
-def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_deps=True):
-    """ first file should be the top level elm-package.json.
-        second file should be the spec level elm-package.json.
-    """
-
-    with open(top_level_file) as f:
-        top_level = elm_package.load(f)
-
-    with open(spec_file) as f:
-        spec = elm_package.load(f)
-
+def sync_spec(top_level, spec, note_test_deps=True):
+    """ brings the deps of the top level package into spec, returning what changed """
     (messages, new_deps) = elm_package.sync_deps(top_level['dependencies'], spec['dependencies'])
     spec['dependencies'] = new_deps
 
@@ -29,9 +22,81 @@ def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_d
                 test_deps[package_name] = package_version
         spec['test-dependencies'] = elm_package.sorted_deps(test_deps)
 
+    return messages
+
+
+def plan_sync(top_level, spec_file, note_test_deps=True):
+    """ works out what syncing spec_file would do, without writing anything.
+        Returns the messages, and the spec, which knows whether anything in it changed.
+    """
+    spec = elm_package.ElmPackage.open(spec_file)
+    messages = sync_spec(top_level, spec, note_test_deps)
+
+    return (messages, spec)
+
+
+def sync_many_versions(top_level_file, spec_files, quiet=False, dry=False, note_test_deps=True, jobs=1):
+    """ syncs one top level elm-package.json into many spec level ones.
+        The top level file is read once, and only the spec files whose contents change are written.
+        Returns how many files were written.
+    """
+
+    with open(top_level_file) as f:
+        top_level = elm_package.load(f)
+
+    plan = lambda spec_file: plan_sync(top_level, spec_file, note_test_deps)
+
+    if jobs > 1 and len(spec_files) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            plans = list(executor.map(plan, spec_files))
+    else:
+        plans = list(map(plan, spec_files))
+
+    changed_files = 0
+    changed_packages = 0
+
+    for (spec_file, (messages, spec)) in zip(spec_files, plans):
+        changed_packages += len(messages)
+
+        if not spec.changed:
+            continue
+
+        changed_files += 1
+
+        if not quiet:
+            print('{spec_file}: {number} packages changed.'.format(spec_file=spec_file, number=len(messages)))
+            if messages:
+                print('\n'.join(messages))
+
+        if not dry:
+            spec.save()
+
+    print('{files} of {total} files changed, {number} packages changed.'.format(
+        files=changed_files, total=len(spec_files), number=changed_packages))
+
+    if dry and changed_files:
+        print("No changes written.")
+        return 0
+
+    return changed_files
+
+
+def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_deps=True):
+    """ first file should be the top level elm-package.json.
+        second file should be the spec level elm-package.json.
+        Returns whether the spec file was written.
+    """
+
+    with open(top_level_file) as f:
+        top_level = elm_package.load(f)
+
+    spec = elm_package.ElmPackage.open(spec_file)
+
+    messages = sync_spec(top_level, spec, note_test_deps)
+
     if len(messages) == 0 and not note_test_deps:
         print('No changes needed.')
-        return
+        return False
 
     print('{number} packages changed.'.format(number=len(messages)))
 
@@ -40,10 +105,9 @@ def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_d
 
     if dry:
         print("No changes written.")
-        return
+        return False
 
-    with open(spec_file, 'w') as f:
-        elm_package.dump(spec, f)
+    return spec.save()
 
 
 def main():
@@ -59,11 +123,48 @@ def main():
     )
 
 
+    parser.add_argument('--no-stamp',
+        action='store_true',
+        help='sync even if neither file has changed since they were last in sync',
+        default=False
+    )
+
+    parser.add_argument('--jobs', '-j', type=int, help='how many spec files to work on at once', default=1)
+
     parser.add_argument('top_level_file')
-    parser.add_argument('spec_file')
+    parser.add_argument('spec_files', nargs='+', metavar='spec_file')
     args = parser.parse_args()
 
-    sync_versions(args.top_level_file, args.spec_file, quiet=args.quiet, dry=args.dry, note_test_deps=args.note)
+    files = [args.top_level_file] + args.spec_files
+    stamp_options = ['note' if args.note else 'no-note']
+    contents = None
+
+    if not args.no_stamp:
+        try:
+            contents = stamps.contents_hash(files)
+        except (IOError, OSError):
+            pass
+
+    if contents and stamps.is_fresh('elm_deps_sync', files, stamp_options, contents=contents):
+        print('No changes needed.')
+        return
+
+    if len(args.spec_files) == 1:
+        written = sync_versions(args.top_level_file, args.spec_files[0], quiet=args.quiet, dry=args.dry, note_test_deps=args.note)
+    else:
+        written = sync_many_versions(
+            args.top_level_file,
+            args.spec_files,
+            quiet=args.quiet,
+            dry=args.dry,
+            note_test_deps=args.note,
+            jobs=args.jobs
+        )
+
+    # only files that were already in sync are stamped: anything written is
+    # checked again on the next run, rather than stamping contents that were never read
+    if contents and not args.dry and not written:
+        stamps.record('elm_deps_sync', files, stamp_options, contents=contents)
 
 
 if __name__ == '__main__':
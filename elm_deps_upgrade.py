@@ -2,27 +2,118 @@
 from __future__ import print_function
 
 import sys
+import os
+import glob
 import json
-import requests
+import time
 import struct
 import argparse
+import asyncio
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import elm_package
+import http_client
+
+
+def default_registry_cache_dir():
+    """ where registry listings are kept between runs, following the XDG base directory spec """
+    return elm_package.cache_dir('registry')
+
+
+# set to None to always go to the registry
+REGISTRY_CACHE_DIR = default_registry_cache_dir()
+
+# seconds a cached listing is used without asking the registry whether it changed
+REGISTRY_CACHE_TTL = 60 * 60
+
+
+def cached_registry_get(url, cache_name):
+    """ GETs a JSON listing from the registry, keeping a copy named cache_name in REGISTRY_CACHE_DIR.
+        A copy younger than REGISTRY_CACHE_TTL is used as is. An older one is revalidated
+        with If-None-Match/If-Modified-Since, so the listing is only sent again if it changed.
+        If the registry can't be reached, whatever copy there is gets used.
+    """
+    if REGISTRY_CACHE_DIR is None:
+        return http_client.get(url).json()
+
+    body_path = os.path.join(REGISTRY_CACHE_DIR, cache_name + '.json')
+    meta_path = os.path.join(REGISTRY_CACHE_DIR, cache_name + '.meta.json')
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        with open(body_path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        meta = None
+        cached = None
+
+    if meta is not None and meta.get('url') != url:
+        meta = None
+        cached = None
+
+    if meta is not None and time.time() - meta['fetched-at'] < REGISTRY_CACHE_TTL:
+        return cached
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last-modified'):
+            headers['If-Modified-Since'] = meta['last-modified']
+
+    try:
+        payload = http_client.get(url, headers=headers)
+        if payload.status_code != 304:
+            payload.raise_for_status()
+    except requests.RequestException as e:
+        if cached is None:
+            raise
+        print('Could not reach {url}, using the cached copy: {error}'.format(url=url, error=e), file=sys.stderr)
+        return cached
+
+    if payload.status_code != 304:
+        cached = payload.json()
+        meta = {
+            'url': url,
+            'etag': payload.headers.get('ETag'),
+            'last-modified': payload.headers.get('Last-Modified'),
+        }
+
+    meta['fetched-at'] = time.time()
+
+    try:
+        os.makedirs(REGISTRY_CACHE_DIR)
+    except OSError:
+        pass
+
+    if payload.status_code != 304:
+        elm_package.write_atomically(body_path, json.dumps(cached))
+    elm_package.write_atomically(meta_path, json.dumps(meta))
+
+    return cached
+
 
 def load_all_packages(elm_version, url=None):
     if url is None:
         url = "http://package.elm-lang.org/all-packages?elm-package-version="
 
-    payload = requests.get("{url}{elm_version}".format(
+    payload = cached_registry_get("{url}{elm_version}".format(
         url=url,
         elm_version=elm_version
-        ))
+        ), 'all-packages-{elm_version}'.format(elm_version=elm_version))
 
-    return { item['name'] : item for item in payload.json() }
+    return { item['name'] : item for item in payload }
 
 def load_versions(package_name, url=None):
     if url is None:
         url = "http://package.elm-lang.org/versions?name="
 
-    payload = requests.get("{url}{package_name}".format(
+    payload = http_client.get("{url}{package_name}".format(
         url=url,
         package_name=package_name
         ))
@@ -30,6 +121,49 @@ def load_versions(package_name, url=None):
     return payload.content
 
 
+def load_many_versions(package_names, concurrency=8, url=None):
+    """ Fetches the version lists of many packages concurrently on an asyncio loop.
+        The load_versions calls run on a thread pool of `concurrency` threads, which is what limits them.
+        Returns entries shaped like load_all_packages', for the packages the registry knows.
+    """
+    async def fetch(name, executor):
+        loop = asyncio.get_event_loop()
+        try:
+            content = await loop.run_in_executor(executor, load_versions, name, url)
+            versions = json.loads(content)
+        except (requests.RequestException, ValueError):
+            return (name, None)
+
+        return (name, versions if isinstance(versions, list) else None)
+
+    async def fetch_all(executor):
+        return await asyncio.gather(*[fetch(name, executor) for name in package_names])
+
+    loop = asyncio.new_event_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            results = loop.run_until_complete(fetch_all(executor))
+    finally:
+        loop.close()
+
+    return dict(
+        (name, {'name': name, 'versions': versions})
+        for (name, versions) in results if versions
+    )
+
+
+def add_missing_packages(package_names, remote_deps, concurrency=8):
+    """ looks up the packages that aren't in remote_deps, `concurrency` at a time, so they still get checked """
+    missing = sorted(set(package_names) - set(remote_deps))
+
+    if not missing:
+        return remote_deps
+
+    complete = dict(remote_deps)
+    complete.update(load_many_versions(missing, concurrency=concurrency))
+    return complete
+
+
 def load_local_packages(elm_package):
     with open(elm_package) as f:
         return json.load(f)['dependencies']
@@ -69,40 +203,86 @@ def minor(version):
 def patch(version):
     return int(version.split('.')[2])
 
-def get_major_upgrades(top, versions):
-    major_top = major(top)
+def parse_version(version):
+    """
+    >>> parse_version('4.0.12')
+    (4, 0, 12)
+    """
+    return tuple(int(part) for part in version.split('.'))
 
-    return [ version for version in versions if major(version) > major_top ]
 
-def get_minor_upgrades(top, versions):
-    major_top = major(top)
-    minor_top = minor(top)
+class VersionIndex(object):
+    """ A package's versions, parsed once and kept sorted so that upgrades are found by bisection.
+        Every lookup returns version strings newest first, the order the registry lists them in.
+
+    >>> index = VersionIndex(['2.0.0', '1.1.0', '1.0.2', '1.0.1', '1.0.0'])
+    >>> index.majors('1.0.1')
+    ['2.0.0']
+    >>> index.minors('1.0.1')
+    ['1.1.0']
+    >>> index.patches('1.0.1')
+    ['1.0.2']
+    """
+
+    __slots__ = ('keys', 'versions')
+
+    def __init__(self, versions):
+        parsed = sorted((parse_version(version), version) for version in versions)
+        self.keys = [key for (key, _) in parsed]
+        self.versions = [version for (_, version) in parsed]
+
+    def between(self, low, high=None):
+        """ versions from low up to, but not including, high """
+        start = bisect.bisect_left(self.keys, low)
+        end = len(self.keys) if high is None else bisect.bisect_left(self.keys, high)
+        return self.versions[start:end][::-1]
 
-    return [ version for version in versions if minor(version) > minor_top and major(version) == major_top ]
+    def majors(self, top):
+        (major_top, _, _) = parse_version(top)
+        return self.between((major_top + 1, 0, 0))
+
+    def minors(self, top):
+        (major_top, minor_top, _) = parse_version(top)
+        return self.between((major_top, minor_top + 1, 0), (major_top + 1, 0, 0))
+
+    def patches(self, top):
+        (major_top, minor_top, patch_top) = parse_version(top)
+        return self.between((major_top, minor_top, patch_top + 1), (major_top, minor_top + 1, 0))
+
+
+def get_major_upgrades(top, versions):
+    return VersionIndex(versions).majors(top)
+
+def get_minor_upgrades(top, versions):
+    return VersionIndex(versions).minors(top)
 
 def get_patch_upgrades(top, versions):
-    major_top = major(top)
-    minor_top = minor(top)
-    patch_top = patch(top)
+    return VersionIndex(versions).patches(top)
 
-    return [ version for version in versions
-        if major(version) == major_top and minor_top == minor(version) and patch_top > patch(version) ]
+def find_newer_versions(local_deps, remote_deps, indexes=None):
+    """ indexes maps package names to their VersionIndex. It is filled in
+        from remote_deps as packages are looked up, so pass the same dict
+        when checking several projects against one registry.
+    """
+    if indexes is None:
+        indexes = {}
 
-def find_newer_versions(local_deps, remote_deps):
     upgrade_suggestions = {}
 
     for (dep, version) in local_deps.items():
         if dep not in remote_deps:
             continue
+
+        if dep not in indexes:
+            indexes[dep] = VersionIndex(remote_deps[dep]['versions'])
+        index = indexes[dep]
+
         current_version = top_range(version)
-        patches = get_patch_upgrades(current_version, remote_deps[dep]['versions'])
-        minors = get_minor_upgrades(current_version, remote_deps[dep]['versions'])
-        majors = get_major_upgrades(current_version, remote_deps[dep]['versions'])
 
         upgrade_suggestions[dep] = {
-            'patches': patches,
-            'minors': minors,
-            'majors': majors
+            'patches': index.patches(current_version),
+            'minors': index.minors(current_version),
+            'majors': index.majors(current_version)
         }
 
     return upgrade_suggestions
@@ -142,22 +322,133 @@ def print_newer_versions(local_deps, remote_deps):
         print('\n'.join(upgrade_suggestions))
 
 
+def expand_manifest_paths(patterns):
+    """ the elm-package.json files matched by each path or glob, in order and without repeats.
+        A glob that matches nothing is an error, rather than nothing to check.
+    """
+    paths = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+
+        if not matches:
+            raise Exception('No files match {pattern}'.format(pattern=pattern))
+
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+
+    return paths
+
+
+def load_many_local_packages(elm_packages, jobs=8):
+    """ reads the dependencies of many elm-package.json files at once, keyed by file """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return OrderedDict(zip(elm_packages, executor.map(load_local_packages, elm_packages)))
+
+
+def find_outdated_projects(projects, remote_deps):
+    """ For every dependency that has upgrades, groups the projects by the range they ask for.
+        Each range is only checked against the registry once, however many projects use it.
+        Returns {dep: {range: {'projects': [...], 'patches': [...], 'minors': [...], 'majors': [...]}}}
+    """
+    ranges = OrderedDict()
+
+    for (project, local_deps) in projects.items():
+        for (dep, version) in local_deps.items():
+            ranges.setdefault(dep, OrderedDict()).setdefault(version, []).append(project)
+
+    indexes = {}
+    report = OrderedDict()
+
+    for (dep, projects_by_range) in sorted(ranges.items()):
+        for (version, dep_projects) in projects_by_range.items():
+            suggestions = find_newer_versions({dep: version}, remote_deps, indexes).get(dep)
+
+            if not suggestions or not (suggestions['patches'] or suggestions['minors'] or suggestions['majors']):
+                continue
+
+            entry = dict(suggestions)
+            entry['projects'] = dep_projects
+            report.setdefault(dep, OrderedDict())[version] = entry
+
+    return report
+
+
+def print_outdated_projects(report):
+    if not report:
+        print('No upgrades available')
+        return
+
+    lines = []
+
+    for (dep, ranges) in report.items():
+        lines.append(dep)
+
+        for (version, entry) in ranges.items():
+            lines.append('  {version} in {count} projects:'.format(version=version, count=len(entry['projects'])))
+            lines.extend('    {project}'.format(project=project) for project in entry['projects'])
+
+            for kind in ('patches', 'minors', 'majors'):
+                if entry[kind]:
+                    lines.append('    {kind} available: [{versions}]'.format(
+                        kind=kind.capitalize(), versions=', '.join(entry[kind])))
+
+    print('\n'.join(lines))
+
+
+def configure_registry_cache(args):
+    global REGISTRY_CACHE_DIR, REGISTRY_CACHE_TTL
+
+    if args.no_cache:
+        REGISTRY_CACHE_DIR = None
+    REGISTRY_CACHE_TTL = args.cache_ttl
+
+
 def main():
 
-    parser = argparse.ArgumentParser(description='Check deps file for possible upgrades')
+    parser = argparse.ArgumentParser(description='Check deps files for possible upgrades')
 
     parser.add_argument('--elm-version', help='specify your current elm version', default='0.18')
-
-    parser.add_argument('local')
+    parser.add_argument('--no-cache', action='store_true', help='always download the package list', default=False)
+    parser.add_argument('--cache-ttl',
+        type=int,
+        help='seconds to use the cached package list before checking for changes',
+        default=REGISTRY_CACHE_TTL
+    )
+    parser.add_argument('--jobs', '-j', type=int, help='how many files to read at once', default=8)
+    parser.add_argument('--concurrency',
+        type=int,
+        help='how many packages missing from the package list to look up at once',
+        default=8
+    )
+
+    parser.add_argument('local', nargs='+', help='elm-package.json files, or globs such as "apps/*/elm-package.json"')
     args = parser.parse_args()
 
-    local = load_local_packages(args.local)
+    configure_registry_cache(args)
+
+    try:
+        elm_packages = expand_manifest_paths(args.local)
+    except Exception as e:
+        parser.error(str(e))
+
     remote = load_all_packages(args.elm_version)
 
-    print_newer_versions(local, remote)
+    http_client.configure(pool_size=max(args.concurrency, http_client.POOL_SIZE))
+
+    if len(elm_packages) == 1:
+        local = load_local_packages(elm_packages[0])
+        remote = add_missing_packages(local, remote, concurrency=args.concurrency)
+        print_newer_versions(local, remote)
+        return
+
+    projects = load_many_local_packages(elm_packages, jobs=args.jobs)
+    all_deps = set(dep for local_deps in projects.values() for dep in local_deps)
+    remote = add_missing_packages(all_deps, remote, concurrency=args.concurrency)
+    print_outdated_projects(find_outdated_projects(projects, remote))
 
 
 
 if __name__ == '__main__':
     main()
-
@@ -3,10 +3,25 @@
 Load and save elm-package.json safely.
 """
 
-# from typing import Dict, Tuple, IO
-import copy
+# from typing import Dict, List, Tuple, IO, Union
 from collections import OrderedDict
+import io
 import json
+import os
+import shutil
+import tempfile
+
+
+# read once, as os.umask can only be read by setting it, which isn't thread safe
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def cache_dir(*parts):
+    # type: (*str) -> str
+    """ a directory under elm-ops-tooling in the user's cache dir, following the XDG base directory spec """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'elm-ops-tooling', *parts)
 
 
 def load(fileobj):
@@ -16,8 +31,10 @@ def load(fileobj):
 
 def dump(package, fileobj):
     # type: (Dict, IO[str]) -> None
-    to_save = copy.deepcopy(package)
-    to_save['dependencies'] = sorted_deps(to_save['dependencies'])
+    to_save = OrderedDict(
+        (key, sorted_deps(value) if key == 'dependencies' else value)
+        for (key, value) in package.items()
+    )
     json.dump(to_save, fileobj, sort_keys=False, indent=4, separators=(',', ': '))
 
 
@@ -29,7 +46,7 @@ def sorted_deps(deps):
 def sync_deps(from_deps, to_deps):
     # type: (Dict, Dict) -> Tuple[List[str], Dict]
     messages = []
-    result = copy.deepcopy(to_deps)
+    result = OrderedDict(to_deps)
 
     for (package_name, package_version) in from_deps.items():
         if package_name not in to_deps:
@@ -47,3 +64,118 @@ def sync_deps(from_deps, to_deps):
             )
 
     return messages, result
+
+
+def write_atomically(path, data):
+    # type: (str, Union[str, bytes]) -> None
+    """ writes to a temporary file next to path, then renames it into place """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class ElmPackage(object):
+    """
+    An elm-package.json, or with exact=True an exact-dependencies.json, open for editing.
+
+    Top level keys that are set to a new value are remembered,
+    so save() only writes a file that something actually changed in.
+    Values are never copied: to change a nested value, assign a new one to its key.
+
+    >>> package = ElmPackage('elm-package.json', OrderedDict([('dependencies', {'elm-lang/core': '5.0.0 <= v < 6.0.0'})]))
+    >>> package['dependencies'] = {'elm-lang/core': '5.0.0 <= v < 6.0.0'}
+    >>> package.changed
+    False
+    >>> package['dependencies'] = {'elm-lang/core': '5.1.0 <= v < 6.0.0'}
+    >>> package.changed
+    True
+    """
+
+    def __init__(self, path, data=None, exact=False):
+        self.path = path
+        self.data = OrderedDict() if data is None else data
+        self.exact = exact
+        self.dirty = set()
+
+    @classmethod
+    def open(cls, path, exact=False, missing_ok=False):
+        # type: (str, bool, bool) -> ElmPackage
+        """ with missing_ok, a file that doesn't exist yet opens as an empty document """
+        try:
+            with open(path) as f:
+                return cls(path, load(f), exact=exact)
+        except IOError:
+            if not missing_ok:
+                raise
+            return cls(path, exact=exact)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key in self.data and self.data[key] == value:
+            return
+
+        self.data[key] = value
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self.dirty.add(key)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def items(self):
+        return self.data.items()
+
+    def update(self, values):
+        # type: (Dict) -> None
+        for (key, value) in values.items():
+            self[key] = value
+
+    def replace(self, values):
+        # type: (Dict) -> None
+        """ makes the document hold exactly values, keeping the order of keys that stay """
+        for key in [key for key in self.data if key not in values]:
+            del self[key]
+        self.update(values)
+
+    @property
+    def changed(self):
+        # type: () -> bool
+        return bool(self.dirty)
+
+    def render(self):
+        # type: () -> str
+        output = io.StringIO()
+
+        if self.exact:
+            json.dump(sorted_deps(self.data), output, sort_keys=False, indent=4, separators=(',', ': '))
+        else:
+            dump(self.data, output)
+
+        return output.getvalue()
+
+    def save(self, force=False):
+        # type: (bool) -> bool
+        """ writes the file if anything changed, returning whether it did """
+        if not self.dirty and not force:
+            return False
+
+        write_atomically(self.path, self.render())
+        self.dirty = set()
+        return True
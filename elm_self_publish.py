@@ -9,6 +9,8 @@ import errno
 import argparse
 from collections import OrderedDict
 
+import elm_package
+
 def copy_package(location, destination, ignorer=None):
     shutil.rmtree(destination, ignore_errors=True)
     shutil.copytree(location, destination, ignore=ignorer)
@@ -58,11 +60,11 @@ def self_publish(package_location, destination=".", quiet=False):
 
 
     with open(elm_package_file) as f:
-        elm_package = json.load(f)
+        package_data = json.load(f)
 
 
-    package_details = package_name(elm_package['repository'])
-    version = elm_package['version']
+    package_details = package_name(package_data['repository'])
+    version = package_data['version']
 
 
     place = package_details['user'] + '/' + package_details['project']
@@ -77,26 +79,26 @@ def self_publish(package_location, destination=".", quiet=False):
 
     try:
         with open(exact_deps_file) as f:
-            data = f.read()
-            package_info = {}
-
-            if data:
-                package_info = json.loads(data)
+            is_blank = not f.read().strip()
     except IOError:
-        package_info = {}
+        is_blank = False
+
+    if is_blank:
+        package_info = elm_package.ElmPackage(exact_deps_file, exact=True)
+    else:
+        package_info = elm_package.ElmPackage.open(exact_deps_file, exact=True, missing_ok=True)
 
     make_elm_stuff_folder(exact_deps_file)
 
-    with open(exact_deps_file, 'w') as f:
-        package_info[place] = version
-        json.dump(package_info, f, sort_keys=False, indent=4)
+    package_info[place] = version
+    package_info.save()
 
-    with open(destination_elm_package_file) as f:
-        destination_elm_package = json.load(f, object_pairs_hook=OrderedDict)
+    destination_elm_package = elm_package.ElmPackage.open(destination_elm_package_file)
 
-    with open(destination_elm_package_file, 'w') as f:
-        destination_elm_package['dependencies'][place] = "{version} <= v <= {version}".format(version=version)
-        json.dump(destination_elm_package, f, sort_keys=False, indent=4)
+    dependencies = OrderedDict(destination_elm_package['dependencies'])
+    dependencies[place] = "{version} <= v <= {version}".format(version=version)
+    destination_elm_package['dependencies'] = dependencies
+    destination_elm_package.save()
 
 
 def main():
@@ -2,72 +2,537 @@
 from __future__ import print_function
 
 import argparse
+import hashlib
+import json
+import os
 import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import elm_package
 
 # = require blah
 #= require blah
 #= require "blah"
 #=require blah
-require_regex = re.compile("#[ ]*=[ ]*require[ \"']*(.+?)[\"'\s]+")
+#= require_tree ./blah
+#= require_directory ./blah
+# each of these with // in place of #, as .js files write them,
+# but not #= require_self
+directive_regex = re.compile(r"(?:#|//)[ ]*=[ ]*(require_tree|require_directory|require(?!_self\b))[ \"']*(.+?)[\"'\s]+")
 
+# every extension Sprockets serves javascript from, longest first
+ASSET_EXTENSIONS = ('.js.coffee.erb', '.coffee.erb', '.js.erb', '.js.coffee', '.coffee', '.js')
 
-def get_require_lines(filename):
-    require_lines = []
+
+def get_directives(filename):
+    """ the (directive, argument) pairs of every require, require_tree and require_directory in a file """
+    directives = []
 
     with open(filename) as f:
         for line in f:
-            matches = re.match(require_regex, line)
+            matches = re.match(directive_regex, line)
 
             if matches is not None:
-                require = matches.groups()[0]
-                require_lines.append(require)
-    return require_lines
+                directives.append(matches.groups())
+    return directives
+
+
+def get_require_lines(filename):
+    return [argument for (directive, argument) in get_directives(filename) if directive == 'require']
+
+
+def asset_name(filename):
+    """
+    The name an asset is required by.
+    >>> asset_name('teach/course.js.coffee')
+    'teach/course'
+    >>> asset_name('vendor/jquery.min.js')
+    'vendor/jquery.min'
+    >>> asset_name('teach/course')
+    'teach/course'
+    """
+    for extension in ASSET_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+
+    return filename
+
+
+class AssetTree(object):
+    """
+    Every asset in assets_dir, found with a single walk of the directory,
+    so resolving a require is a dictionary lookup rather than a guess at a filename.
+    """
+
+    def __init__(self, assets_dir, read_directives=None):
+        self.assets_dir = assets_dir
+        self.read_directives = read_directives or get_directives
+
+        # name -> path relative to assets_dir
+        self.paths = {}
+        # directory -> the name of its index, which a plain require of the directory gets
+        self.aliases = {}
+        self.directories = set([''])
+
+        for path in asset_files(assets_dir):
+            name = asset_name(path)
+            self.paths.setdefault(name, path)
+
+            directory = os.path.dirname(name)
+            while directory not in self.directories:
+                self.directories.add(directory)
+                directory = os.path.dirname(directory)
+
+            if os.path.basename(name) == 'index':
+                self.aliases.setdefault(os.path.dirname(name), name)
+
+    def resolve(self, require, from_name=''):
+        """
+        >>> AssetTree.__new__(AssetTree).resolve('../shared/base.js', 'teach/course')
+        'shared/base'
+        >>> AssetTree.__new__(AssetTree).resolve('shared/base', 'teach/course')
+        'shared/base'
+        """
+        if require.startswith('./') or require.startswith('../') or require == '.':
+            require = os.path.join(os.path.dirname(from_name), require)
+
+        name = os.path.normpath(asset_name(require))
+        return '' if name == '.' else name
+
+    def lookup(self, name):
+        """ the name of the asset a plain require of name gets, which is a directory's index for a directory """
+        if name in self.paths:
+            return name
+
+        return self.aliases.get(name)
+
+    def requires(self, filename, from_name=''):
+        """
+        The names filename requires, with require_tree and require_directory expanded,
+        and the requires that match nothing.
+        """
+        found = []
+        missing = []
+
+        for (directive, argument) in self.read_directives(filename):
+            name = self.resolve(argument, from_name)
+
+            if directive == 'require':
+                if self.lookup(name) is not None:
+                    found.append(self.lookup(name))
+                else:
+                    missing.append(name)
+            elif name not in self.directories:
+                missing.append(argument)
+            elif directive == 'require_tree':
+                prefix = name + '/' if name else ''
+                found.extend(sorted(
+                    other for other in self.paths
+                    if other.startswith(prefix) and other != from_name
+                ))
+            else:
+                found.extend(sorted(
+                    other for other in self.paths
+                    if os.path.dirname(other) == name and other != from_name
+                ))
+
+        return (found, missing)
+
+    def requires_of(self, name):
+        return self.requires(os.path.join(self.assets_dir, self.paths[name]), name)
+
+    def graph(self):
+        """ the requires of every asset, by name """
+        return dict((name, self.requires_of(name)[0]) for name in self.paths)
+
+
+def default_index_path(assets_dir):
+    """ each asset dir gets its own index in the XDG cache dir """
+    name = hashlib.sha256(os.path.abspath(assets_dir).encode('utf-8')).hexdigest()
+    return os.path.join(elm_package.cache_dir('coffee-requires'), name + '.json')
+
+
+def asset_files(assets_dir):
+    """ every file a require could point to, relative to assets_dir """
+    for (root, dirs, files) in os.walk(assets_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(ASSET_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, filename), assets_dir)
+
+
+def load_require_index(index_path):
+    """ the directives in each asset file, with the mtime and size they were read at """
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def is_within_directory(directory, path):
+    """
+    >>> is_within_directory('app/assets', 'app/assets/teach.js.coffee')
+    True
+    >>> is_within_directory('app/assets', 'app/assets-index.json')
+    False
+    """
+    directory = os.path.realpath(directory)
+    return os.path.commonprefix([directory + os.sep, os.path.realpath(path)]) == directory + os.sep
+
+
+def save_require_index(index_path, index, assets_dir):
+    if is_within_directory(assets_dir, index_path):
+        raise Exception('Refusing to write the require index to {path}, as it is inside the asset dir {assets_dir}'.format(
+            path=index_path, assets_dir=assets_dir))
+
+    try:
+        os.makedirs(os.path.dirname(index_path))
+    except OSError:
+        pass
+
+    elm_package.write_atomically(index_path, json.dumps(index, sort_keys=True, indent=4, separators=(',', ': ')))
+
+
+def update_require_index(assets_dir, index, jobs=1):
+    """
+    Brings the index up to date with assets_dir, rereading only the files
+    whose mtime or size changed, up to `jobs` at once.
+    Returns the new index, and whether it differs from the old one.
+    """
+    new_index = {}
+    stale = []
+
+    for name in asset_files(assets_dir):
+        stat = os.stat(os.path.join(assets_dir, name))
+        entry = index.get(name)
+
+        if (entry is not None and 'directives' in entry
+                and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size):
+            new_index[name] = entry
+        else:
+            new_index[name] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+            stale.append(name)
+
+    read = lambda name: get_directives(os.path.join(assets_dir, name))
+
+    if jobs > 1 and len(stale) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            scanned = list(executor.map(read, stale))
+    else:
+        scanned = list(map(read, stale))
+
+    for (name, directives) in zip(stale, scanned):
+        new_index[name]['directives'] = [list(directive) for directive in directives]
+
+    return (new_index, bool(stale) or set(new_index) != set(index))
+
+
+def indexed_directives(assets_dir, index):
+    """ a get_directives that answers from the index, for files in assets_dir """
+
+    def read_directives(filename):
+        entry = index.get(os.path.relpath(filename, assets_dir))
+
+        if entry is None:
+            return get_directives(filename)
+
+        return [tuple(directive) for directive in entry['directives']]
+
+    return read_directives
+
+
+# walk_requires(assets_dir: str, starting_filename: str, read_directives: Callable, tree: AssetTree) -> Tuple[List[str], List[str], List[List[str]]]
+def walk_requires(assets_dir, starting_filename, read_directives=None, tree=None):
+    """
+    Walks everything reachable from starting_filename through its requires, reading each file once
+    with read_directives, which defaults to get_directives. An AssetTree that is already built
+    can be passed in to walk from many files without scanning assets_dir again.
+
+    Returns (found, missing, cycles). found holds every require that was found,
+    each one after the requires it needs itself. missing holds every require that
+    matches no asset, in the order they were first seen. cycles holds each require
+    chain that leads back to where it started.
+    """
+    tree = tree or AssetTree(assets_dir, read_directives)
+    start = asset_name(os.path.relpath(starting_filename, assets_dir))
+
+    found = []
+    missing = []
+    cycles = []
+
+    (start_requires, start_missing) = tree.requires(starting_filename, start)
+    missing.extend(start_missing)
+
+    # names being walked, in the order they were entered, starting with the starting file
+    path = [start]
+    walking = set(path)
+    seen = set(path)
+    stack = [iter(start_requires)]
+
+    while stack:
+        require = next(stack[-1], None)
+
+        if require is None:
+            stack.pop()
+            walking.discard(path[-1])
+            done = path.pop()
+            if stack:
+                found.append(done)
+            continue
+
+        if require in walking:
+            cycles.append(path[path.index(require):] + [require])
+            continue
+
+        if require in seen:
+            continue
+
+        seen.add(require)
+
+        (requires, require_missing) = tree.requires_of(require)
+        missing.extend(name for name in require_missing if name not in missing)
+
+        path.append(require)
+        walking.add(require)
+        stack.append(iter(requires))
+
+    return (found, missing, cycles)
 
 
 # get_requirement_filenames(starting_filename: str) -> Tuple[List[str], List[str]]
 def get_requirement_filenames(assets_dir, starting_filename):
-    all_file_names = []
-    missing_file_names = []
-
-    require_lines = get_require_lines(starting_filename)
-
-    for require in require_lines:
-        try:
-            current_require_lines, current_missing_filenames = get_requirement_filenames(
-                assets_dir,
-                "{assets_dir}{require}.js.coffee".format(
-                    assets_dir=assets_dir,
-                    require=require
-                )
-            )
-            all_file_names.extend(current_require_lines)
-            missing_file_names.extend(current_missing_filenames)
-        except IOError:
-            missing_file_names.append(require)
-            continue
+    (found, missing, _) = walk_requires(assets_dir, starting_filename)
+    return (found, missing)
 
-    all_file_names.extend(
-        require for require in require_lines
-        if require not in missing_file_names
-    )
 
-    return (list(set(all_file_names)), list(set(missing_file_names)))
+# bundle_manifest(tree: AssetTree, starting_filename: str) -> Tuple[List[str], List[str], List[List[str]]]
+def bundle_manifest(tree, starting_filename):
+    """
+    Every file in the bundle for starting_filename, in the order they are concatenated:
+    each file comes after the files it requires, and starting_filename comes last.
+    Returns (filenames, missing, cycles), as walk_requires.
+    """
+    (found, missing, cycles) = walk_requires(tree.assets_dir, starting_filename, tree=tree)
+
+    filenames = []
+    seen = set()
+
+    for filename in [os.path.join(tree.assets_dir, tree.paths[name]) for name in found] + [starting_filename]:
+        if os.path.realpath(filename) not in seen:
+            seen.add(os.path.realpath(filename))
+            filenames.append(filename)
+
+    return (filenames, missing, cycles)
+
+
+# copy_file_contents(source: IO[bytes], destination: IO[bytes]) -> int
+def copy_file_contents(source, destination):
+    """ copies in the kernel with sendfile where it can, returning the number of bytes copied """
+    size = os.fstat(source.fileno()).st_size
+    offset = 0
+
+    try:
+        while offset < size:
+            sent = os.sendfile(destination.fileno(), source.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except (AttributeError, OSError):
+        # no sendfile on this platform, or not between these files
+        source.seek(offset)
+        shutil.copyfileobj(source, destination, 64 * 1024)
+        destination.flush()
+        return size
+
+    return offset
+
+
+# write_bundle(filenames: List[str], output: str) -> int
+def write_bundle(filenames, output):
+    """
+    Concatenates already compiled javascript files into output, without reading them into memory.
+    Returns the size of the bundle.
+    """
+    needs_compiling = [filename for filename in filenames if not filename.endswith('.js')]
+    if needs_compiling:
+        raise Exception('Only plain .js files can be bundled, but these need compiling first:\n{files}'.format(
+            files='\n'.join(needs_compiling)))
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(output) or '.', prefix='.' + os.path.basename(output), suffix='.tmp')
+    total = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as bundle:
+            for filename in filenames:
+                with open(filename, 'rb') as f:
+                    copied = copy_file_contents(f, bundle)
+
+                    # keep the last line of one file from running into the next
+                    if copied:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            bundle.write(b'\n')
+                            bundle.flush()
+                            copied += 1
+
+                total += copied
+
+        os.chmod(tmp_path, 0o666 & ~elm_package.UMASK)
+        os.rename(tmp_path, output)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    return total
+
 
+def require_name(assets_dir, filename):
+    """
+    The name other assets require a file by.
+    >>> require_name('app/assets/', 'app/assets/teach/course.js.coffee')
+    'teach/course'
+    >>> require_name('app/assets/', 'teach/course')
+    'teach/course'
+    """
+    if not filename.endswith(ASSET_EXTENSIONS):
+        return filename
+
+    return asset_name(os.path.relpath(filename, assets_dir))
+
+
+def reverse_graph(graph):
+    """
+    What requires each require directly.
+    >>> reverse_graph({'main': ['a', 'b'], 'a': ['b'], 'b': []})
+    {'a': ['main'], 'b': ['a', 'main']}
+    """
+    dependents = {}
+
+    for (name, requires) in graph.items():
+        for require in requires:
+            dependents.setdefault(require, set()).add(name)
+
+    return dict((require, sorted(names)) for (require, names) in dependents.items())
+
+
+def find_dependents(dependents, require):
+    """
+    Everything that requires require, directly or through other requires, nearest first.
+    >>> find_dependents({'a': ['main'], 'b': ['a', 'main'], 'main': ['b']}, 'b')
+    ['a', 'main']
+    """
+    found = []
+    seen = set([require])
+    queue = [require]
+
+    for current in queue:
+        for name in dependents.get(current, []):
+            if name not in seen:
+                seen.add(name)
+                found.append(name)
+                queue.append(name)
+
+    return found
 
 
 def main():
     parser = argparse.ArgumentParser(description='Check deps matching between a parent and a sub')
 
     # example 'app/assets/javascripts/teach/course-creation-component.js.coffee'
-    parser.add_argument('filename', help='The file to use for starting the requirement search')
+    parser.add_argument('filenames', nargs='+', help='The files to use for starting the requirement search')
     parser.add_argument('--asset-dir', dest='asset_dir', const='./', default='./', action='store', nargs='?', help='Asset dir to look into')
+    parser.add_argument('--index',
+        action='store_true',
+        help='keep the require lines of every asset in an index, and only reread files that changed',
+        default=False
+    )
+    parser.add_argument('--index-path', help='where to keep the index. Defaults to one in the XDG cache dir')
+    parser.add_argument('--jobs', '-j', type=int, help='how many changed files to reread at once', default=1)
+    parser.add_argument('--manifest',
+        action='store_true',
+        help='list the files that make up the bundle for each file, in the order they are concatenated',
+        default=False
+    )
+    parser.add_argument('--output', '-o', help='concatenate the bundle for the file into this file. Its inputs must all be plain .js')
+    parser.add_argument('--dependents',
+        action='store_true',
+        help='list what requires each file instead, directly or not, and which entry points that includes',
+        default=False
+    )
     args = parser.parse_args()
 
-    (requirement_filenames, missing_filenames) = get_requirement_filenames(args.asset_dir, args.filename)
+    if args.output and len(args.filenames) > 1:
+        parser.error('--output takes a single file to bundle')
+
+    read_directives = None
+
+    if args.index:
+        index_path = args.index_path or default_index_path(args.asset_dir)
+
+        if is_within_directory(args.asset_dir, index_path):
+            parser.error('--index-path can\'t be inside the asset dir')
+
+        (index, changed) = update_require_index(args.asset_dir, load_require_index(index_path), jobs=args.jobs)
+
+        if changed:
+            save_require_index(index_path, index, args.asset_dir)
+
+        read_directives = indexed_directives(args.asset_dir, index)
+
+    tree = AssetTree(args.asset_dir, read_directives)
+
+    if args.dependents:
+        graph = tree.graph()
+        dependents = reverse_graph(graph)
+
+        for filename in args.filenames:
+            name = require_name(args.asset_dir, filename)
+            name = tree.lookup(name) or name
+            names = find_dependents(dependents, name)
+
+            print('{name} is required by:\n'.format(name=name))
+            print('\n'.join(names))
+            print('--------------\n Entry points:\n\n')
+            print('\n'.join(name for name in names if name not in dependents))
+        return
+
+    if args.manifest or args.output:
+        for filename in args.filenames:
+            (filenames, missing_filenames, cycles) = bundle_manifest(tree, filename)
+
+            if missing_filenames:
+                print('The bundle for {file} is missing:\n\n{missing}'.format(
+                    file=filename, missing='\n'.join(missing_filenames)))
+                sys.exit(1)
+
+            if cycles:
+                print('The bundle for {file} can\'t be ordered, as these requires lead back to themselves:\n\n{cycles}'.format(
+                    file=filename, cycles='\n'.join(' -> '.join(cycle) for cycle in cycles)))
+                sys.exit(1)
+
+            if args.output:
+                size = write_bundle(filenames, args.output)
+                print('Wrote {number} files, {size} bytes, to {output}'.format(
+                    number=len(filenames), size=size, output=args.output))
+            else:
+                print('\n'.join(filenames))
+        return
+
+    for filename in args.filenames:
+        (requirement_filenames, missing_filenames, cycles) = walk_requires(args.asset_dir, filename, tree=tree)
+
+        print('\n'.join(requirement_filenames))
+        print('--------------\n But I couldn\'t find the following files:\n\n')
+        print('\n'.join(missing_filenames))
 
-    print('\n'.join(requirement_filenames))
-    print('--------------\n But I couldn\'t find the following files:\n\n')
-    print('\n'.join(missing_filenames))
+        if cycles:
+            print('--------------\n These requires lead back to themselves:\n\n')
+            print('\n'.join(' -> '.join(cycle) for cycle in cycles))
 
 
 if __name__ == '__main__':
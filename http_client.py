@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+"""
+The HTTP session shared by every tool.
+
+Connections are pooled and kept alive, so a run that makes dozens of calls
+to the package registry or github only pays for the handshake once per host.
+The pool size and timeout default to $ELM_OPS_HTTP_POOL_SIZE and
+$ELM_OPS_HTTP_TIMEOUT, and can be changed with configure().
+"""
+
+# from typing import Any, Optional
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# connections kept open per host
+POOL_SIZE = int(os.environ.get('ELM_OPS_HTTP_POOL_SIZE', 10))
+
+# seconds to wait for a server to connect or send data
+TIMEOUT = float(os.environ.get('ELM_OPS_HTTP_TIMEOUT', 30))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(pool_size=None, timeout=None):
+    # type: (Optional[int], Optional[float]) -> None
+    """ the session is rebuilt on next use if the pool size changes """
+    global POOL_SIZE, TIMEOUT, _session
+
+    with _session_lock:
+        if pool_size is not None and pool_size != POOL_SIZE:
+            POOL_SIZE = pool_size
+            _session = None
+        if timeout is not None:
+            TIMEOUT = timeout
+
+
+def session():
+    # type: () -> requests.Session
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            new_session = requests.Session()
+            new_session.mount('http://', adapter)
+            new_session.mount('https://', adapter)
+            _session = new_session
+
+        return _session
+
+
+def get(url, **kwargs):
+    # type: (str, **Any) -> requests.Response
+    kwargs.setdefault('timeout', TIMEOUT)
+    return session().get(url, **kwargs)
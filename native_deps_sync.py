@@ -3,11 +3,64 @@ from __future__ import print_function
 
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import elm_package
 import exact_dependencies
 
 
+def plan_sync(top_level, spec_file):
+    """ works out what syncing spec_file would do, without writing anything.
+        Returns the messages, and the spec, which knows whether anything in it changed.
+    """
+    spec = elm_package.ElmPackage.open(spec_file, exact=True)
+    (messages, new_deps) = elm_package.sync_deps(top_level, spec.data)
+    spec.update(new_deps)
+
+    return (messages, spec)
+
+
+def sync_many_versions(top_level_file, spec_files, quiet=False, dry=False, jobs=1):
+    """ syncs one top level elm-native-package.json into many spec level ones.
+        The top level file is read once, and only the spec files whose contents change are written.
+    """
+
+    with open(top_level_file) as f:
+        top_level = exact_dependencies.load(f)
+
+    plan = lambda spec_file: plan_sync(top_level, spec_file)
+
+    if jobs > 1 and len(spec_files) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            plans = list(executor.map(plan, spec_files))
+    else:
+        plans = list(map(plan, spec_files))
+
+    changed_files = 0
+    changed_packages = 0
+
+    for (spec_file, (messages, spec)) in zip(spec_files, plans):
+        changed_packages += len(messages)
+
+        if not messages:
+            continue
+
+        changed_files += 1
+
+        if not quiet:
+            print('{spec_file}: {number} packages changed.'.format(spec_file=spec_file, number=len(messages)))
+            print('\n'.join(messages))
+
+        if not dry:
+            spec.save()
+
+    print('{files} of {total} files changed, {number} packages changed.'.format(
+        files=changed_files, total=len(spec_files), number=changed_packages))
+
+    if dry and changed_files:
+        print("No changes written.")
+
+
 def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_deps=True):
     """ first file should be the top level elm-native-package.json.
         second file should be the spec level elm-native-package.json.
@@ -16,11 +69,10 @@ def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_d
     with open(top_level_file) as f:
         top_level = exact_dependencies.load(f)
 
-    with open(spec_file) as f:
-        spec = exact_dependencies.load(f)
+    spec = elm_package.ElmPackage.open(spec_file, exact=True)
 
-    (messages, new_deps) = elm_package.sync_deps(top_level, spec)
-    spec = new_deps
+    (messages, new_deps) = elm_package.sync_deps(top_level, spec.data)
+    spec.update(new_deps)
 
     if len(messages) == 0:
         print('No changes needed.')
@@ -35,8 +87,7 @@ def sync_versions(top_level_file, spec_file, quiet=False, dry=False, note_test_d
         print("No changes written.")
         return
 
-    with open(spec_file, 'w') as f:
-        exact_dependencies.dump(spec, f)
+    spec.save()
 
 
 
@@ -46,11 +97,15 @@ def main():
 
     parser.add_argument('--quiet', '-q', action='store_true', help='don\'t print anything', default=False)
     parser.add_argument('--dry', '-d', action='store_true', help='only print possible changes', default=False)
+    parser.add_argument('--jobs', '-j', type=int, help='how many spec files to work on at once', default=1)
     parser.add_argument('top_level_file')
-    parser.add_argument('spec_file')
+    parser.add_argument('spec_files', nargs='+', metavar='spec_file')
     args = parser.parse_args()
 
-    sync_versions(args.top_level_file, args.spec_file, quiet=args.quiet, dry=args.dry)
+    if len(args.spec_files) == 1:
+        sync_versions(args.top_level_file, args.spec_files[0], quiet=args.quiet, dry=args.dry)
+    else:
+        sync_many_versions(args.top_level_file, args.spec_files, quiet=args.quiet, dry=args.dry, jobs=args.jobs)
 
 
 if __name__ == '__main__':
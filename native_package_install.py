@@ -5,18 +5,46 @@ from __future__ import print_function
 import argparse
 import collections
 import fnmatch
+import hashlib
+import json
+import mmap
 import os
+import random
+import shutil
 import sys
 import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
 try:
     # For Python 3.0 and later
-    from urllib.request import urlretrieve
+    from http.client import HTTPException
 except ImportError:
-    # Fall back to Python 2's urllib2
-    from urllib import urlretrieve
+    # Fall back to Python 2's httplib
+    from httplib import HTTPException
+
+import requests
+from urllib3.exceptions import HTTPError as Urllib3Error
 
 import elm_package
 import exact_dependencies
+import http_client
+
+
+# written into each installed package, listing its native files
+NATIVE_INDEX_FILENAME = '.native-files.json'
+
+# written into the vendor dir, recording how far each package's install got
+INSTALL_STATE_FILENAME = '.native-install-state.json'
+
+# how many times in a row a download may fail before giving up
+DOWNLOAD_RETRIES = 5
+
+# seconds to wait before the first retry, doubling on each one after
+DOWNLOAD_BACKOFF = 0.5
+
+# folders that never hold native code worth munging
+UNSEARCHED_DIRS = set(['elm-stuff', 'node_modules'])
 
 
 def read_native_elm_package(package_file):
@@ -87,38 +115,452 @@ def vendor_package_dir(vendor_dir, package):
     )
 
 
-def fetch_packages(vendor_dir, packages):
+def is_within_directory(directory, target):
     """
-    Fetches all packages from github.
+    Checks that target does not escape directory once both are made absolute.
+    >>> is_within_directory('vendor', 'vendor/elm-lang/core-1.0.0')
+    True
+    >>> is_within_directory('vendor', 'vendor/../etc/passwd')
+    False
     """
-    for package in packages:
+    abs_directory = os.path.abspath(directory)
+    abs_target = os.path.abspath(target)
+
+    prefix = os.path.commonprefix([abs_directory, abs_target])
+
+    return prefix == abs_directory
+
+
+def is_needed_file(relative_path, source_dirs):
+    """
+    Whether a file from a package archive is used once installed:
+    the elm files in its source directories, and the javascript in their Native folders.
+    >>> is_needed_file('src/List/Extra.elm', ['src'])
+    True
+    >>> is_needed_file('src/Native/List.js', ['src/'])
+    True
+    >>> is_needed_file('examples/Native/List.js', ['.'])
+    True
+    >>> is_needed_file('tests/Main.elm', ['src'])
+    False
+    >>> is_needed_file('src/app.js', ['src'])
+    False
+    >>> is_needed_file('srcs/Main.elm', ['src'])
+    False
+    """
+    if relative_path.endswith('.js'):
+        if 'Native' not in os.path.dirname(relative_path):
+            return False
+    elif not relative_path.endswith('.elm'):
+        return False
+
+    for source_dir in source_dirs:
+        source_dir = os.path.normpath(source_dir)
+        if source_dir == '.' or relative_path.startswith(source_dir + '/'):
+            return True
+
+    return False
+
+
+def write_member(path, member, data):
+    """ writes out a member whose contents have already been read from the archive """
+    member_path = os.path.join(path, member.name)
+    try:
+        os.makedirs(os.path.dirname(member_path))
+    except OSError:
+        pass
+
+    with open(member_path, 'wb') as f:
+        f.write(data)
+    os.chmod(member_path, member.mode)
+
+
+def extract_tar_stream(fileobj, path, selective=False):
+    """
+    Extracts a tarball in a single forward pass, so it is only decompressed once.
+    Every member's path is checked before anything is written.
+
+    When selective, only elm-package.json and the files that is_needed_file
+    picks out using its source-directories are written. Candidates that come
+    before elm-package.json in the archive are held in memory until it is read.
+    """
+    source_dirs = None
+    pending = []
+
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+        for member in tar:
+            member_path = os.path.join(path, member.name)
+            if not is_within_directory(path, member_path):
+                raise Exception("Attempted Path Traversal in Tar File")
+
+            if not selective:
+                tar.extract(member, path)
+                continue
+
+            # directories are created as the files inside them are written
+            if not member.isfile():
+                continue
+
+            relative_path = member.name.split('/', 1)[-1]
+
+            if relative_path == 'elm-package.json' and source_dirs is None:
+                data = tar.extractfile(member).read()
+                source_dirs = json.loads(data.decode('utf-8')).get('source-directories', [])
+                write_member(path, member, data)
+
+                for (pending_member, pending_data) in pending:
+                    if is_needed_file(pending_member.name.split('/', 1)[-1], source_dirs):
+                        write_member(path, pending_member, pending_data)
+                pending = []
+            elif source_dirs is None:
+                if relative_path.endswith('.elm') or relative_path.endswith('.js'):
+                    pending.append((member, tar.extractfile(member).read()))
+            elif is_needed_file(relative_path, source_dirs):
+                tar.extract(member, path)
+
+    # without a manifest there is no way to tell what is needed, so keep every candidate
+    for (pending_member, pending_data) in pending:
+        write_member(path, pending_member, pending_data)
+
+
+class HashingReader(object):
+    """
+    Wraps a file object, hashing everything read through it
+    and optionally copying it into another file as it goes.
+    """
+
+    def __init__(self, fileobj, copy_to=None):
+        self.fileobj = fileobj
+        self.copy_to = copy_to
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.digest.update(data)
+        if self.copy_to is not None:
+            self.copy_to.write(data)
+        return data
+
+    def drain(self):
+        """ read whatever the tar reader left behind, e.g. the gzip trailer """
+        while self.read(64 * 1024):
+            pass
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def backoff_delay(attempt, base=None, cap=30):
+    """
+    Exponential backoff with full jitter: a random wait of up to base * 2 ** attempt seconds.
+    >>> 0 <= backoff_delay(3, base=0.5) <= 4
+    True
+    >>> backoff_delay(20, base=0.5) <= 30
+    True
+    """
+    if base is None:
+        base = DOWNLOAD_BACKOFF
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def http_status(error):
+    """ the status code behind a failed request, if the server got as far as sending one """
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def is_retryable(error):
+    """ client errors such as a 404 won't go away by asking again """
+    status = http_status(error)
+    if status is not None:
+        return status >= 500 or status in (408, 429)
+    return True
+
+
+class ResumableResponse(object):
+    """
+    A file-like view of a url that survives dropped connections.
+    When connecting or reading fails, it waits with backoff and reconnects with
+    a Range request, carrying on from the last byte it handed out.
+    Gives up after `retries` failures in a row.
+    Connections come from the shared http_client session.
+    """
+
+    def __init__(self, url, offset=0, retries=None):
+        self.url = url
+        self.offset = offset
+        self.retries = DOWNLOAD_RETRIES if retries is None else retries
+        self.failures = 0
+        self.response = None
+
+    def connect(self):
+        headers = {}
+        if self.offset:
+            headers['Range'] = 'bytes={offset}-'.format(offset=self.offset)
+
+        response = http_client.get(self.url, headers=headers, stream=True)
+        response.raise_for_status()
+
+        if self.offset and response.status_code != 206:
+            # the server ignored the range, so skip over what we already have
+            skipped = 0
+            while skipped < self.offset:
+                chunk = response.raw.read(min(64 * 1024, self.offset - skipped), decode_content=True)
+                if not chunk:
+                    break
+                skipped += len(chunk)
+
+        return response
+
+    def read(self, size=-1):
+        while True:
+            try:
+                if self.response is None:
+                    self.response = self.connect()
+                data = self.response.raw.read(None if size < 0 else size, decode_content=True)
+            except (IOError, HTTPException, Urllib3Error) as e:
+                self.close()
+                self.failures += 1
+                if self.failures > self.retries or not is_retryable(e):
+                    raise
+
+                delay = backoff_delay(self.failures)
+                print("Retrying {url} from byte {offset} in {delay:.1f}s after: {error}".format(
+                    url=self.url, offset=self.offset, delay=delay, error=e))
+                time.sleep(delay)
+                continue
+
+            if data:
+                self.failures = 0
+            self.offset += len(data)
+            return data
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+
+def download(url, filename):
+    """
+    Downloads url to filename. The bytes go to filename.part first, so a download
+    that is interrupted, even by killing the process, is resumed rather than restarted.
+    """
+    part_filename = filename + '.part'
+    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+
+    try:
+        with closing(ResumableResponse(url, offset=offset)) as response:
+            with open(part_filename, 'ab') as f:
+                shutil.copyfileobj(response, f, 64 * 1024)
+    except requests.HTTPError as e:
+        # 416: the partial download doesn't fit what the server has now, so start over
+        if http_status(e) != 416 or not offset:
+            raise
+        os.remove(part_filename)
+        return download(url, filename)
+
+    os.rename(part_filename, filename)
+
+
+def default_cache_dir():
+    """ the shared tarball cache, following the XDG base directory spec """
+    return elm_package.cache_dir('native-packages')
+
+
+def file_sha256(path):
+    """ sha256 hex digest of a file, read in chunks """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_index_path(cache_dir, package):
+    """
+    The file recording which tarball a package version resolved to.
+    >>> cache_index_path('cache', {'owner': 'elm-lang', 'project': 'navigation', 'version': '2.0.0'})
+    'cache/elm-lang/navigation/2.0.0.sha256'
+    """
+    return os.path.join(cache_dir, package['owner'], package['project'], package['version'] + '.sha256')
+
+
+def cache_blob_path(cache_dir, sha256):
+    """
+    Tarballs are stored by content.
+    >>> cache_blob_path('cache', 'abc123')
+    'cache/sha256/abc123.tar.gz'
+    """
+    return os.path.join(cache_dir, 'sha256', sha256 + '.tar.gz')
+
+
+def lookup_cached_tarball(cache_dir, package):
+    """
+    Returns the path of the cached tarball for a package, or None if it is
+    missing or its contents no longer match the recorded hash.
+    """
+    try:
+        with open(cache_index_path(cache_dir, package)) as f:
+            sha256 = f.read().strip()
+    except IOError:
+        return None
+
+    blob_path = cache_blob_path(cache_dir, sha256)
+    if not os.path.isfile(blob_path) or file_sha256(blob_path) != sha256:
+        return None
+
+    return blob_path
+
+
+def store_cached_tarball(cache_dir, package, tar_filename, sha256=None):
+    """
+    Moves a downloaded tarball into the cache and records it against the package.
+    Returns the path of the cached tarball.
+    """
+    if sha256 is None:
+        sha256 = file_sha256(tar_filename)
+    blob_path = cache_blob_path(cache_dir, sha256)
+    index_path = cache_index_path(cache_dir, package)
+
+    for path in (blob_path, index_path):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+    # move under a temporary name first so a half-copied blob is never visible
+    tmp_blob_path = '{path}.{pid}.tmp'.format(path=blob_path, pid=os.getpid())
+    shutil.move(tar_filename, tmp_blob_path)
+    os.rename(tmp_blob_path, blob_path)
+
+    elm_package.write_atomically(index_path, sha256)
+
+    return blob_path
+
+
+def stream_package(vendor_dir, package, cache_dir=None, selective=False):
+    """
+    Pipes the tarball from github straight into the extractor.
+    Nothing touches the disk apart from the extracted files,
+    unless a cache is in use, in which case the bytes are copied into it on the way.
+    Returns the sha256 of the tarball.
+    """
+    vendor_owner_dir = ensure_vendor_owner_dir(vendor_dir, package['owner'])
+    url = format_tarball_url(package)
+
+    print("Streaming {owner}/{project} {version}".format(**package))
+    with closing(ResumableResponse(url)) as response:
+        if cache_dir is None:
+            reader = HashingReader(response)
+            extract_tar_stream(reader, vendor_owner_dir, selective=selective)
+            reader.drain()
+            return reader.hexdigest()
+
+        tar_filename = format_tar_path(vendor_dir, package)
+        try:
+            with open(tar_filename, 'wb') as copy:
+                reader = HashingReader(response, copy_to=copy)
+                extract_tar_stream(reader, vendor_owner_dir, selective=selective)
+                reader.drain()
+        except Exception:
+            os.remove(tar_filename)
+            raise
+
+    store_cached_tarball(cache_dir, package, tar_filename, sha256=reader.hexdigest())
+    return reader.hexdigest()
+
+
+def fetch_package(vendor_dir, package, cache_dir=None, offline=False, stream=False, selective=False,
+                  cached_path=None):
+    """
+    Fetches a single package and extracts it into the vendor dir.
+    The tarball comes from the cache when possible, otherwise from github.
+    cached_path is a cached tarball the caller has already verified, so it isn't looked up again.
+    Returns the sha256 of the tarball.
+    """
+    vendor_owner_dir = ensure_vendor_owner_dir(vendor_dir, package['owner'])
+    tar_filename = cached_path
+
+    if tar_filename is None and cache_dir is not None:
+        tar_filename = lookup_cached_tarball(cache_dir, package)
+
+    if tar_filename is not None:
+        print("Using cached {owner}/{project} {version}".format(**package))
+    elif offline:
+        raise Exception("{owner}/{project} {version} is not in the cache".format(**package))
+    elif stream:
+        return stream_package(vendor_dir, package, cache_dir=cache_dir, selective=selective)
+    else:
         tar_filename = format_tar_path(vendor_dir, package)
-        vendor_owner_dir = ensure_vendor_owner_dir(vendor_dir, package['owner'])
         url = format_tarball_url(package)
 
         print("Downloading {owner}/{project} {version}".format(**package))
-        urlretrieve(url, tar_filename)
-        with tarfile.open(tar_filename) as tar:
-            def is_within_directory(directory, target):
-                
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-            
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-                
-                return prefix == abs_directory
-            
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-            
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
-            
-                tar.extractall(path, members, numeric_owner=numeric_owner) 
-                
-            
-            safe_extract(tar, vendor_owner_dir, members=tar.getmembers())
+        download(url, tar_filename)
+
+        if cache_dir is not None:
+            tar_filename = store_cached_tarball(cache_dir, package, tar_filename)
+
+    with open(tar_filename, 'rb') as f:
+        reader = HashingReader(f)
+        extract_tar_stream(reader, vendor_owner_dir, selective=selective)
+        reader.drain()
+
+    if cache_dir is None:
+        # nothing will look at the tarball again once it is extracted
+        os.remove(tar_filename)
+
+    return reader.hexdigest()
+
+
+def fetch_packages(vendor_dir, packages, jobs=1, cache_dir=None, offline=False, stream=False, selective=False):
+    """
+    Fetches all packages, running up to `jobs` downloads at once.
+    Every package is attempted; failures are reported per package and raised
+    together once all downloads have finished.
+    When offline, nothing is fetched unless every package is already cached.
+    The sha256 of each tarball is recorded on its package as it is fetched.
+    """
+    cached_paths = {}
+    if offline:
+        missing = []
+        for package in packages:
+            cached_path = None if cache_dir is None else lookup_cached_tarball(cache_dir, package)
+            if cached_path is None:
+                missing.append(package)
+            else:
+                cached_paths[package_name(package)] = cached_path
+        if missing:
+            raise Exception("Offline, but {number} packages are not cached: {names}".format(
+                number=len(missing),
+                names=', '.join('{owner}/{project} {version}'.format(**package) for package in missing)
+            ))
+
+    errors = []
+
+    def fetch(package):
+        try:
+            package['sha256'] = fetch_package(
+                vendor_dir, package, cache_dir=cache_dir, offline=offline, stream=stream, selective=selective,
+                cached_path=cached_paths.get(package_name(package)))
+        except Exception as e:
+            print("Failed to fetch {owner}/{project} {version}: {error}".format(error=e, **package))
+            errors.append(package)
+            return
+        print("Installed {owner}/{project} {version}".format(**package))
+
+    if jobs > 1 and len(packages) > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(fetch, packages))
+    else:
+        for package in packages:
+            fetch(package)
+
+    if errors:
+        raise Exception("Failed to fetch {number} packages: {names}".format(
+            number=len(errors),
+            names=', '.join('{owner}/{project}'.format(**package) for package in errors)
+        ))
 
     return packages
 
@@ -158,83 +600,206 @@ def package_name_from_repo(repository):
     return (owner, project)
 
 
-def get_source_dirs(vendor_dir, package):
-    """ get the source-directories out of an elm-package file """
-    elm_package_filename = os.path.join(vendor_package_dir(vendor_dir, package), 'elm-package.json')
+def read_vendor_manifest(package_dir, manifest_cache=None):
+    """ parse the elm-package.json of an installed package, at most once per manifest_cache """
+    elm_package_filename = os.path.join(package_dir, 'elm-package.json')
+
+    if manifest_cache is not None and elm_package_filename in manifest_cache:
+        return manifest_cache[elm_package_filename]
+
     with open(elm_package_filename) as f:
         data = elm_package.load(f)
 
-    return data['source-directories']
+    if manifest_cache is not None:
+        manifest_cache[elm_package_filename] = data
+
+    return data
+
+
+def get_source_dirs(vendor_dir, package, manifest_cache=None):
+    """ get the source-directories out of an elm-package file """
+    return read_vendor_manifest(vendor_package_dir(vendor_dir, package), manifest_cache)['source-directories']
+
+
+def file_contains(path, needle):
+    """ checks for needle without reading the whole file into memory """
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped, and can't contain anything either
+            return False
+        with closing(mapped):
+            return mapped.find(needle) != -1
 
 
 def replace_in_file(filePath, src, target):
-    """ find replace in a file """
-    output = ""
-    with open(filePath) as infile:
-        output = infile.read().replace(src, target)
-    with open(filePath, 'w') as outfile:
-        outfile.write(output)
-
-
-def find_all_native_files(path):
-    """ recursivly find all js files in a package """
-    native_files = []
-    for root, dirnames, filenames in os.walk(path):
-        if "Native" not in root:
+    """
+    find replace in a file. The file is only rewritten if it actually changes.
+    Returns whether it was rewritten.
+    """
+    src = src.encode('utf-8')
+    target = target.encode('utf-8')
+
+    if not file_contains(filePath, src):
+        return False
+
+    with open(filePath, 'rb') as infile:
+        contents = infile.read()
+
+    output = contents.replace(src, target)
+    if output == contents:
+        return False
+
+    elm_package.write_atomically(filePath, output)
+    return True
+
+
+def package_source_dirs(package_dir, manifest_cache=None):
+    """ the source-directories of an installed package, or None if it has no elm-package.json """
+    try:
+        return read_vendor_manifest(package_dir, manifest_cache).get('source-directories')
+    except IOError:
+        return None
+
+
+def scan_native_files(path, source_dirs=None):
+    """
+    Finds the js files in Native folders with os.scandir.
+    Only the source directories are searched when they are known,
+    and hidden folders, elm-stuff and node_modules are never entered.
+    """
+    roots = ['.']
+    if source_dirs is not None:
+        roots = [os.path.normpath(source_dir) for source_dir in source_dirs]
+        roots = [root for root in roots if not root.startswith('..')]
+        if '.' in roots:
+            roots = ['.']
+
+    native_files = set()
+    stack = [os.path.normpath(os.path.join(path, root)) for root in roots]
+
+    while stack:
+        directory = stack.pop()
+        in_native = 'Native' in os.path.relpath(directory, path)
+
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
             continue
-        for filename in fnmatch.filter(filenames, '*.js'):
-            native_files.append(os.path.join(root, filename))
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.') and entry.name not in UNSEARCHED_DIRS:
+                    stack.append(entry.path)
+            elif in_native and fnmatch.fnmatch(entry.name, '*.js'):
+                native_files.add(entry.path)
+
+    return sorted(native_files)
+
+
+def find_all_native_files(path, manifest_cache=None):
+    """
+    recursivly find all js files in a package.
+    The result is stored in the package as NATIVE_INDEX_FILENAME,
+    so a package is only ever searched once.
+    """
+    index_path = os.path.join(path, NATIVE_INDEX_FILENAME)
+
+    try:
+        with open(index_path) as f:
+            return [os.path.join(path, native_file) for native_file in json.load(f)]
+    except (IOError, ValueError):
+        pass
+
+    native_files = scan_native_files(path, package_source_dirs(path, manifest_cache))
+
+    if os.path.isdir(path):
+        relative_paths = [os.path.relpath(native_file, path) for native_file in native_files]
+        elm_package.write_atomically(index_path, json.dumps(relative_paths, indent=4).encode('utf-8'))
+
     return native_files
 
 
-def munge_names(vendor_dir, repository, packages):
+def munge_names(vendor_dir, repository, packages, jobs=1, manifest_cache=None):
     """
     Replaces the namespaced function names in all native code by the namespace from the given elm-package.json.
+    With more than one job, files are rewritten in a process pool.
+    Returns the number of files that changed.
     """
     owner, project = package_name_from_repo(repository)
+    target = format_native_name(owner, project)
+
+    file_paths = []
+    srcs = []
     for package in packages:
-        native_files = find_all_native_files(vendor_package_dir(vendor_dir, package))
-        for native_file in native_files:
-            replace_in_file(
-                native_file,
-                format_native_name(package['owner'], package['project']),
-                format_native_name(owner, project)
-            )
+        src = format_native_name(package['owner'], package['project'])
+        if src == target:
+            continue
+
+        package_dir = vendor_package_dir(vendor_dir, package)
+        for native_file in find_all_native_files(package_dir, manifest_cache):
+            file_paths.append(native_file)
+            srcs.append(src)
 
+    targets = [target] * len(file_paths)
 
-def update_source_directories(vendor_dir, elm_package_paths, native_packages):
+    if jobs > 1 and len(file_paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            changed = list(executor.map(
+                replace_in_file, file_paths, srcs, targets,
+                chunksize=max(1, len(file_paths) // (jobs * 4))
+            ))
+    else:
+        changed = list(map(replace_in_file, file_paths, srcs, targets))
+
+    return sum(changed)
+
+
+def update_source_directories(vendor_dir, elm_package_paths, native_packages, manifest_cache=None):
     """
     Updates the source-directories in the given elm-package.json files.
     Returns the repository of the last elm-package.json.
+    Each native package's elm-package.json is read once, however many files are updated.
     """
 
+    if manifest_cache is None:
+        manifest_cache = {}
+
+    native_source_dirs = []
+    seen_source_dirs = set()
+
+    for native_package in native_packages:
+        package_dir = vendor_package_dir(vendor_dir, native_package)
+
+        for source_dir in get_source_dirs(vendor_dir, native_package, manifest_cache):
+            absolute_source_dir = os.path.join(package_dir, source_dir)
+
+            if absolute_source_dir not in seen_source_dirs:
+                seen_source_dirs.add(absolute_source_dir)
+                native_source_dirs.append(absolute_source_dir)
+
     repository = ""
 
     for elm_package_path in elm_package_paths:
-        with open(elm_package_path) as f:
-            data = elm_package.load(f)
+        package = elm_package.ElmPackage.open(elm_package_path)
 
-        repository = data['repository']
-        source_directories = data['source-directories']
+        repository = package['repository']
         elm_package_dir = os.path.dirname(elm_package_path)
+        existing_source_dirs = set(package['source-directories'])
+        added_source_dirs = []
 
-        needs_save = False
-
-        for native_package in native_packages:
-            source_dirs = get_source_dirs(vendor_dir, native_package)
+        for absolute_source_dir in native_source_dirs:
+            relative_path = os.path.relpath(absolute_source_dir, elm_package_dir)
 
-            for source_dir in source_dirs:
-                absolute_source_dir = os.path.join(
-                    vendor_package_dir(vendor_dir, native_package), source_dir)
-                relative_path = os.path.relpath(absolute_source_dir, elm_package_dir)
+            if relative_path not in existing_source_dirs:
+                existing_source_dirs.add(relative_path)
+                added_source_dirs.append(relative_path)
 
-                if relative_path not in data['source-directories']:
-                    data['source-directories'].append(relative_path)
-                    needs_save = True
+        if added_source_dirs:
+            package['source-directories'] = package['source-directories'] + added_source_dirs
 
-        if needs_save:
-            with open(elm_package_path, 'w') as f:
-                elm_package.dump(data, f)
+        package.save()
 
     return repository
 
@@ -247,17 +812,126 @@ def package_exists(vendor_dir, package):
     return os.path.isdir(vendor_package_dir(vendor_dir, package))
 
 
-def main(native_elm_package_path, elm_package_paths, vendor_dir):
+def package_name(package):
+    """
+    >>> package_name({'owner': 'elm-lang', 'project': 'navigation', 'version': '2.0.0'})
+    'elm-lang/navigation'
+    """
+    return '{owner}/{project}'.format(**package)
+
+
+def load_install_state(vendor_dir):
+    """ what earlier runs got done for each package, keyed by package name """
+    try:
+        with open(os.path.join(vendor_dir, INSTALL_STATE_FILENAME)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_install_state(vendor_dir, state):
+    try:
+        os.makedirs(vendor_dir)
+    except OSError:
+        pass
+
+    elm_package.write_atomically(
+        os.path.join(vendor_dir, INSTALL_STATE_FILENAME),
+        json.dumps(state, sort_keys=True, indent=4, separators=(',', ': ')).encode('utf-8')
+    )
+
+
+def install_state_entry(vendor_dir, state, package):
+    """
+    The state recorded for the wanted version of a package.
+    A package that was installed before there was a state file counts as
+    extracted, but has its source directories and native names checked again.
+    A package whose directory has gone missing since is installed again from scratch.
+    """
+    name = package_name(package)
+    entry = state.get(name)
+
+    if entry is None or entry.get('version') != package['version']:
+        entry = {
+            'version': package['version'],
+            'extracted': entry is None and package_exists(vendor_dir, package),
+        }
+        state[name] = entry
+    elif entry.get('extracted') and not package_exists(vendor_dir, package):
+        entry = {
+            'version': package['version'],
+            'extracted': False,
+        }
+        state[name] = entry
+
+    return entry
+
+
+def main(native_elm_package_path, elm_package_paths, vendor_dir,
+         jobs=1, cache_dir=None, offline=False, stream=False, selective=False):
     absolute_vendor_dir = os.path.abspath(vendor_dir)
     absolute_elm_package_paths = list(map(os.path.abspath, elm_package_paths))
+    relative_elm_package_paths = [
+        os.path.relpath(elm_package_path, absolute_vendor_dir) for elm_package_path in absolute_elm_package_paths]
 
     raw_json = read_native_elm_package(native_elm_package_path)
     all_packages = packages_from_exact_deps(raw_json)
-    required_packages = exclude_existing_packages(absolute_vendor_dir, all_packages)
-    fetch_packages(absolute_vendor_dir, required_packages)
+
+    state = load_install_state(absolute_vendor_dir)
+    for package in all_packages:
+        install_state_entry(absolute_vendor_dir, state, package)
+
+    required_packages = [package for package in all_packages if not state[package_name(package)]['extracted']]
+    for package in required_packages:
+        # anything here was left behind by an interrupted extraction
+        shutil.rmtree(vendor_package_dir(absolute_vendor_dir, package), ignore_errors=True)
+
+    try:
+        fetch_packages(
+            absolute_vendor_dir,
+            required_packages,
+            jobs=jobs,
+            cache_dir=cache_dir,
+            offline=offline,
+            stream=stream,
+            selective=selective
+        )
+    finally:
+        for package in required_packages:
+            if 'sha256' in package:
+                state[package_name(package)] = {
+                    'version': package['version'],
+                    'sha256': package['sha256'],
+                    'extracted': True,
+                }
+        if required_packages:
+            save_install_state(absolute_vendor_dir, state)
+
+    unregistered_packages = [
+        package for package in all_packages
+        if not set(relative_elm_package_paths).issubset(state[package_name(package)].get('source-directories-in', []))
+    ]
+
+    manifest_cache = {}
     repository = update_source_directories(
-        absolute_vendor_dir, absolute_elm_package_paths, required_packages)
-    munge_names(absolute_vendor_dir, repository, required_packages)
+        absolute_vendor_dir, absolute_elm_package_paths, unregistered_packages, manifest_cache)
+
+    if unregistered_packages:
+        for package in unregistered_packages:
+            entry = state[package_name(package)]
+            entry['source-directories-in'] = sorted(
+                set(entry.get('source-directories-in', [])).union(relative_elm_package_paths))
+        save_install_state(absolute_vendor_dir, state)
+
+    native_name = format_native_name(*package_name_from_repo(repository))
+    unmunged_packages = [
+        package for package in all_packages if state[package_name(package)].get('munged-as') != native_name]
+
+    if unmunged_packages:
+        munge_names(absolute_vendor_dir, repository, unmunged_packages, jobs=jobs, manifest_cache=manifest_cache)
+        for package in unmunged_packages:
+            state[package_name(package)]['munged-as'] = native_name
+        save_install_state(absolute_vendor_dir, state)
 
 
 def test():
@@ -274,6 +948,14 @@ if __name__ == '__main__':
     )
     parser.add_argument('--elm-config', '-e', nargs='+')
     parser.add_argument('--vendor-dir', default='vendor/assets/elm')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='number of packages to download, and processes to rename native code with, at once')
+    parser.add_argument('--cache-dir', default=default_cache_dir(), help='where downloaded tarballs are kept between runs')
+    parser.add_argument('--no-cache', action='store_true', help='always download from github')
+    parser.add_argument('--offline', action='store_true', help='fail unless every package is in the cache')
+    parser.add_argument('--stream', action='store_true', help='extract while downloading instead of saving the tarball first')
+    parser.add_argument('--selective', action='store_true', help='only extract the files elm needs from each package')
+    parser.add_argument('--retries', type=int, default=DOWNLOAD_RETRIES, help='how many times in a row a download may fail')
+    parser.add_argument('--timeout', type=float, default=http_client.TIMEOUT, help='seconds to wait for github on each attempt')
     parser.add_argument('--test', '-t', action='store_true')
 
     args = parser.parse_args()
@@ -281,4 +963,16 @@ if __name__ == '__main__':
         test()
         exit()
 
-    main(args.native_elm_package, args.elm_config, args.vendor_dir)
+    DOWNLOAD_RETRIES = args.retries
+    http_client.configure(pool_size=max(args.jobs, http_client.POOL_SIZE), timeout=args.timeout)
+
+    main(
+        args.native_elm_package,
+        args.elm_config,
+        args.vendor_dir,
+        jobs=args.jobs,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        offline=args.offline,
+        stream=args.stream,
+        selective=args.selective
+    )
@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+"""
+Remember that a check passed for some exact set of inputs.
+
+A stamp is kept per tool, set of files and options, and records the sha256
+of the files' contents when the tool last succeeded. While the contents
+still hash the same, the tool can skip its work and give the same answer.
+Stamps live in $ELM_OPS_STAMP_DIR, or $XDG_CACHE_HOME/elm-ops-tooling/stamps.
+"""
+
+# from typing import Iterable, Optional
+import hashlib
+import os
+
+import elm_package
+
+
+def default_stamp_dir():
+    # type: () -> str
+    if os.environ.get('ELM_OPS_STAMP_DIR'):
+        return os.environ['ELM_OPS_STAMP_DIR']
+
+    return elm_package.cache_dir('stamps')
+
+
+def stamp_path(tool, files, options=(), stamp_dir=None):
+    # type: (str, Iterable[str], Iterable[str], Optional[str]) -> str
+    """ where the stamp for this tool, these files and these options lives """
+    identity = hashlib.sha256()
+
+    for part in [tool] + [os.path.abspath(filename) for filename in files] + [str(option) for option in options]:
+        identity.update(part.encode('utf-8'))
+        identity.update(b'\0')
+
+    return os.path.join(stamp_dir or default_stamp_dir(), identity.hexdigest())
+
+
+def contents_hash(files):
+    # type: (Iterable[str]) -> str
+    digest = hashlib.sha256()
+
+    for filename in files:
+        with open(filename, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+
+    return digest.hexdigest()
+
+
+def is_fresh(tool, files, options=(), stamp_dir=None, contents=None):
+    # type: (str, Iterable[str], Iterable[str], Optional[str], Optional[str]) -> bool
+    """ whether the tool last succeeded on exactly what the files contain now,
+        or on contents, a contents_hash of the files taken earlier
+    """
+    files = list(files)
+
+    try:
+        with open(stamp_path(tool, files, options, stamp_dir)) as f:
+            recorded = f.read().strip()
+        return recorded == (contents or contents_hash(files))
+    except (IOError, OSError):
+        return False
+
+
+def record(tool, files, options=(), stamp_dir=None, contents=None):
+    # type: (str, Iterable[str], Iterable[str], Optional[str], Optional[str]) -> None
+    """ contents should be the contents_hash of the files taken before the tool read them,
+        so that an edit made while the tool ran is never stamped as passing
+    """
+    files = list(files)
+    path = stamp_path(tool, files, options, stamp_dir)
+
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+
+    elm_package.write_atomically(path, contents or contents_hash(files))
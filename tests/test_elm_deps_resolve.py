@@ -0,0 +1,71 @@
+import json
+
+import elm_deps_resolve
+
+
+snapshot = {
+    'elm-lang/core': {
+        '4.0.5': {},
+        '5.0.0': {},
+        '5.1.1': {},
+    },
+    'elm-lang/html': {
+        '1.1.0': {'elm-lang/core': '4.0.0 <= v < 5.0.0'},
+        '2.0.0': {'elm-lang/core': '5.0.0 <= v < 6.0.0', 'elm-lang/virtual-dom': '2.0.0 <= v < 3.0.0'},
+    },
+    'elm-lang/virtual-dom': {
+        '2.0.4': {'elm-lang/core': '5.0.0 <= v < 6.0.0'},
+    },
+    'NoRedInk/old-widget': {
+        '1.0.0': {'elm-lang/html': '1.0.0 <= v < 2.0.0'},
+    },
+}
+
+
+def test_resolve_backtracks_to_versions_that_fit_together():
+    resolved = elm_deps_resolve.resolve({
+        'elm-lang/core': '4.0.0 <= v < 6.0.0',
+        'elm-lang/html': '1.0.0 <= v < 3.0.0',
+        'NoRedInk/old-widget': '1.0.0 <= v < 2.0.0',
+    }, elm_deps_resolve.SnapshotSource(snapshot))
+
+    assert resolved == {
+        'elm-lang/core': '4.0.5',
+        'elm-lang/html': '1.1.0',
+        'NoRedInk/old-widget': '1.0.0',
+    }
+
+
+def test_resolve_includes_transitive_dependencies():
+    resolved = elm_deps_resolve.resolve({
+        'elm-lang/core': '5.0.0 <= v < 6.0.0',
+        'elm-lang/html': '2.0.0 <= v < 3.0.0',
+    }, elm_deps_resolve.SnapshotSource(snapshot))
+
+    assert resolved == {
+        'elm-lang/core': '5.1.1',
+        'elm-lang/html': '2.0.0',
+        'elm-lang/virtual-dom': '2.0.4',
+    }
+
+
+def test_resolve_elm_package_checks_existing_lockfile(tmpdir):
+    snapshot_path = tmpdir.join('snapshot.json')
+    snapshot_path.write(json.dumps(snapshot))
+
+    elm_package_path = tmpdir.join('elm-package.json')
+    elm_package_path.write(json.dumps({'dependencies': {'elm-lang/html': '2.0.0 <= v < 3.0.0'}}))
+
+    exact_deps_path = tmpdir.join('exact-dependencies.json')
+    exact_deps_path.write(json.dumps({
+        'elm-lang/core': '5.0.0',
+        'elm-lang/html': '2.0.0',
+        'elm-lang/virtual-dom': '2.0.4',
+    }))
+
+    resolved = elm_deps_resolve.resolve_elm_package(str(elm_package_path), str(snapshot_path))
+    errors = elm_deps_resolve.check_exact_dependencies(resolved, str(exact_deps_path))
+
+    assert errors == [
+        'elm-lang/core resolves to 5.1.1, but {file} has 5.0.0'.format(file=exact_deps_path),
+    ]
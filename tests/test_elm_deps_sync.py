@@ -7,6 +7,7 @@ from hypothesis import given
 import hypothesis.strategies as st
 
 import elm_deps_sync
+import elm_package
 
 
 package_skeleton = {
@@ -113,3 +114,28 @@ def _make_package(keys, deps):
     package = OrderedDict((key, package_skeleton[key]) for key in keys)
     package['dependencies'] = OrderedDict(deps)
     return package
+
+
+def test_sync_many_versions_only_writes_changed_specs(tmpdir):
+    top_level_file = tmpdir.join('elm-package.json')
+    top_level_file.write(json.dumps(_make_package(package_skeleton.keys(), top_level_deps)))
+
+    in_sync = tmpdir.join('in-sync-elm-package.json')
+    with open(str(in_sync), 'w') as f:
+        elm_package.dump(_make_package(package_skeleton.keys(), top_level_deps), f)
+
+    out_of_sync = tmpdir.join('out-of-sync-elm-package.json')
+    out_of_sync.write(json.dumps(_make_package(package_skeleton.keys(), spec_deps)))
+
+    in_sync_mtime = in_sync.mtime()
+    in_sync.setmtime(in_sync_mtime - 100)
+
+    elm_deps_sync.sync_many_versions(
+        str(top_level_file),
+        [str(in_sync), str(out_of_sync)],
+        note_test_deps=False,
+        jobs=2)
+
+    assert in_sync.mtime() == in_sync_mtime - 100
+    new_spec = json.loads(out_of_sync.read(), object_pairs_hook=OrderedDict)
+    assert list(new_spec['dependencies'].keys()) == ['NoRedInk/spec-1', 'NoRedInk/spec-2', 'NoRedInk/top-1', 'NoRedInk/top-2', 'NoRedInk/top-3']
@@ -0,0 +1,112 @@
+import pytest
+
+import elm_deps_upgrade
+
+
+class FakeResponse(object):
+    def __init__(self, payload=None, status_code=200, headers=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+
+all_packages = [{'name': 'elm-lang/core', 'versions': ['5.1.1', '5.1.0', '5.0.0']}]
+
+
+def test_load_all_packages_revalidates_cached_listing(tmpdir, mocker):
+    mocker.patch.object(elm_deps_upgrade, 'REGISTRY_CACHE_DIR', str(tmpdir))
+    get = mocker.patch.object(
+        elm_deps_upgrade.http_client,
+        'get',
+        return_value=FakeResponse(all_packages, headers={'ETag': '"v1"'}))
+
+    first = elm_deps_upgrade.load_all_packages('0.18')
+    assert get.call_count == 1
+
+    # still fresh: the registry isn't asked at all
+    assert elm_deps_upgrade.load_all_packages('0.18') == first
+    assert get.call_count == 1
+
+    # stale: the registry is asked whether it changed, and says it didn't
+    mocker.patch.object(elm_deps_upgrade, 'REGISTRY_CACHE_TTL', 0)
+    get.return_value = FakeResponse(status_code=304)
+    assert elm_deps_upgrade.load_all_packages('0.18') == first
+    assert get.call_args[1]['headers'] == {'If-None-Match': '"v1"'}
+
+    # another elm version has its own listing
+    get.return_value = FakeResponse([])
+    assert elm_deps_upgrade.load_all_packages('0.17') == {}
+
+
+def test_find_outdated_projects_groups_projects_by_range():
+    remote = {item['name']: item for item in all_packages}
+    projects = {
+        'apps/a/elm-package.json': {'elm-lang/core': '5.0.0 <= v <= 5.0.0', 'NoRedInk/private': '1.0.0 <= v < 2.0.0'},
+        'apps/b/elm-package.json': {'elm-lang/core': '5.0.0 <= v <= 5.0.0'},
+        'apps/c/elm-package.json': {'elm-lang/core': '5.1.1 <= v <= 5.1.1'},
+    }
+
+    report = elm_deps_upgrade.find_outdated_projects(projects, remote)
+
+    assert list(report) == ['elm-lang/core']
+    assert list(report['elm-lang/core']) == ['5.0.0 <= v <= 5.0.0']
+    entry = report['elm-lang/core']['5.0.0 <= v <= 5.0.0']
+    assert sorted(entry['projects']) == ['apps/a/elm-package.json', 'apps/b/elm-package.json']
+    assert entry['minors'] == ['5.1.1', '5.1.0']
+
+
+def test_expand_manifest_paths_accepts_globs(tmpdir):
+    for name in ('b', 'a'):
+        tmpdir.join('apps', name, 'elm-package.json').write('{}', ensure=True)
+
+    with tmpdir.as_cwd():
+        paths = elm_deps_upgrade.expand_manifest_paths(['apps/*/elm-package.json', 'apps/a/elm-package.json'])
+
+    assert paths == ['apps/a/elm-package.json', 'apps/b/elm-package.json']
+
+
+def test_expand_manifest_paths_fails_on_a_glob_that_matches_nothing(tmpdir):
+    with tmpdir.as_cwd():
+        with pytest.raises(Exception):
+            elm_deps_upgrade.expand_manifest_paths(['apps/*/elm-package.json'])
+
+
+def test_add_missing_packages_looks_up_only_unlisted_packages(mocker):
+    remote = {item['name']: item for item in all_packages}
+    versions = {
+        'NoRedInk/private': b'["1.1.0", "1.0.0"]',
+        'NoRedInk/unknown': b'<html>not found</html>',
+    }
+    load_versions = mocker.patch.object(
+        elm_deps_upgrade, 'load_versions', side_effect=lambda name, url: versions[name])
+
+    complete = elm_deps_upgrade.add_missing_packages(
+        ['elm-lang/core', 'NoRedInk/private', 'NoRedInk/unknown'], remote, concurrency=2)
+
+    assert sorted(call[0][0] for call in load_versions.call_args_list) == ['NoRedInk/private', 'NoRedInk/unknown']
+    assert complete['NoRedInk/private'] == {'name': 'NoRedInk/private', 'versions': ['1.1.0', '1.0.0']}
+    assert 'NoRedInk/unknown' not in complete
+    assert complete['elm-lang/core'] == remote['elm-lang/core']
+
+
+def test_get_patch_upgrades_lists_newer_patches_only():
+    versions = ['5.1.1', '5.1.0', '5.0.2', '5.0.1', '5.0.0']
+
+    assert elm_deps_upgrade.get_patch_upgrades('5.0.1', versions) == ['5.0.2']
+    assert elm_deps_upgrade.get_patch_upgrades('5.0.2', versions) == []
+
+
+def test_print_newer_versions_reports_newer_patches(capsys):
+    remote = {'elm-lang/core': {'name': 'elm-lang/core', 'versions': ['5.1.1', '5.1.0', '5.0.2', '5.0.1', '5.0.0']}}
+
+    elm_deps_upgrade.print_newer_versions({'elm-lang/core': '5.0.1 <= v <= 5.0.1'}, remote)
+    assert 'Patches available for elm-lang/core: [5.0.2]' in capsys.readouterr().out
+
+    elm_deps_upgrade.print_newer_versions({'elm-lang/core': '5.1.1 <= v <= 5.1.1'}, remote)
+    assert capsys.readouterr().out == 'No upgrades available\n'
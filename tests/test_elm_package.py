@@ -8,3 +8,18 @@ def test_sync_deps_messages_when_version_is_changed():
     messages, new_deps = elm_package.sync_deps(from_deps, to_deps)
     assert len(messages) == 1
     assert '0.1.0 to 1.0.0' in messages[0]
+
+
+def test_elm_package_only_saves_when_something_changed(tmpdir):
+    path = tmpdir.join('elm-package.json')
+    path.write('{"version": "1.0.0", "dependencies": {"elm-lang/core": "5.0.0 <= v < 6.0.0"}}')
+
+    package = elm_package.ElmPackage.open(str(path))
+    package['version'] = '1.0.0'
+    assert not package.save()
+    assert path.read() == '{"version": "1.0.0", "dependencies": {"elm-lang/core": "5.0.0 <= v < 6.0.0"}}'
+
+    package['dependencies'] = {'elm-lang/core': '5.1.0 <= v < 6.0.0'}
+    assert package.save()
+    assert elm_package.ElmPackage.open(str(path))['dependencies'] == {'elm-lang/core': '5.1.0 <= v < 6.0.0'}
+    assert not package.changed
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+import elm_self_publish
+
+
+def make_projects(tmpdir, exact_deps):
+    package = tmpdir.mkdir('elm-css')
+    package.join('elm-package.json').write(json.dumps({
+        'repository': 'https://github.com/rtfeldman/elm-css.git',
+        'version': '1.0.0',
+    }))
+
+    destination = tmpdir.mkdir('app')
+    destination.join('elm-package.json').write(json.dumps({'dependencies': {}}))
+    destination.join('elm-stuff', 'exact-dependencies.json').write(exact_deps, ensure=True)
+
+    return (package, destination)
+
+
+def test_self_publish_adds_to_a_blank_exact_dependencies_file(tmpdir):
+    (package, destination) = make_projects(tmpdir, '\n')
+
+    elm_self_publish.self_publish(str(package), str(destination))
+
+    assert json.loads(destination.join('elm-stuff', 'exact-dependencies.json').read()) == \
+        {'rtfeldman/elm-css': '1.0.0'}
+
+
+def test_self_publish_leaves_an_invalid_exact_dependencies_file_alone(tmpdir):
+    (package, destination) = make_projects(tmpdir, '{"elm-lang/core": "5.1.1",')
+
+    with pytest.raises(ValueError):
+        elm_self_publish.self_publish(str(package), str(destination))
+
+    assert destination.join('elm-stuff', 'exact-dependencies.json').read() == '{"elm-lang/core": "5.1.1",'
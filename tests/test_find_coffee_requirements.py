@@ -0,0 +1,147 @@
+import pytest
+
+import find_coffee_requirements
+
+
+def write_asset(tmpdir, name, *requires):
+    tmpdir.join(name + '.js.coffee').write(
+        ''.join('#= require {require}\n'.format(require=require) for require in requires) + 'x = 1\n',
+        ensure=True)
+
+
+def test_walk_requires_reads_shared_requires_once(tmpdir, mocker):
+    write_asset(tmpdir, 'main', 'left', 'right')
+    write_asset(tmpdir, 'left', 'shared/base')
+    write_asset(tmpdir, 'right', 'shared/base', 'missing')
+    write_asset(tmpdir, 'shared/base')
+
+    get_directives = mocker.spy(find_coffee_requirements, 'get_directives')
+    assets_dir = str(tmpdir) + '/'
+
+    (found, missing, cycles) = find_coffee_requirements.walk_requires(assets_dir, assets_dir + 'main.js.coffee')
+
+    assert found == ['shared/base', 'left', 'right']
+    assert missing == ['missing']
+    assert cycles == []
+    read = [call[0][0] for call in get_directives.call_args_list]
+    assert len(read) == len(set(read)) == 4
+
+
+def test_walk_requires_reports_cycles(tmpdir):
+    write_asset(tmpdir, 'main', 'a')
+    write_asset(tmpdir, 'a', 'b')
+    write_asset(tmpdir, 'b', 'a')
+    assets_dir = str(tmpdir) + '/'
+
+    (found, missing, cycles) = find_coffee_requirements.walk_requires(assets_dir, assets_dir + 'main.js.coffee')
+
+    assert found == ['b', 'a']
+    assert cycles == [['a', 'b', 'a']]
+
+
+def test_require_index_only_rereads_changed_files(tmpdir, mocker):
+    write_asset(tmpdir, 'main', 'a')
+    write_asset(tmpdir, 'a')
+    assets_dir = str(tmpdir) + '/'
+
+    (index, changed) = find_coffee_requirements.update_require_index(assets_dir, {}, jobs=2)
+    assert changed
+    assert index['main.js.coffee']['directives'] == [['require', 'a']]
+
+    get_directives = mocker.spy(find_coffee_requirements, 'get_directives')
+    (index, changed) = find_coffee_requirements.update_require_index(assets_dir, index)
+    assert not changed
+    assert get_directives.call_count == 0
+
+    write_asset(tmpdir, 'a', 'b/c')
+    (index, changed) = find_coffee_requirements.update_require_index(assets_dir, index)
+    assert changed
+    assert [call[0][0] for call in get_directives.call_args_list] == [assets_dir + 'a.js.coffee']
+
+    read_directives = find_coffee_requirements.indexed_directives(assets_dir, index)
+    (found, missing, _) = find_coffee_requirements.walk_requires(assets_dir, assets_dir + 'main.js.coffee', read_directives)
+    assert found == ['a']
+    assert missing == ['b/c']
+    assert get_directives.call_count == 1
+
+
+def test_find_dependents_follows_requires_backwards(tmpdir):
+    write_asset(tmpdir, 'teach', 'widgets/button', 'shared/base')
+    write_asset(tmpdir, 'learn', 'widgets/button')
+    write_asset(tmpdir, 'widgets/button', 'shared/base')
+    write_asset(tmpdir, 'shared/base')
+    assets_dir = str(tmpdir) + '/'
+
+    dependents = find_coffee_requirements.reverse_graph(find_coffee_requirements.AssetTree(assets_dir).graph())
+
+    assert find_coffee_requirements.find_dependents(dependents, 'shared/base') == ['teach', 'widgets/button', 'learn']
+    assert find_coffee_requirements.find_dependents(dependents, 'teach') == []
+
+
+def test_walk_requires_follows_every_asset_type_and_directory_directive(tmpdir):
+    tmpdir.join('main.js').write('//= require vendor/jquery\n//= require_tree ./widgets\n//= require_directory ./pages\n')
+    tmpdir.join('vendor', 'jquery.js').write('', ensure=True)
+    tmpdir.join('widgets', 'button.coffee').write('#= require ../shared\n', ensure=True)
+    tmpdir.join('widgets', 'forms', 'input.js.erb').write('', ensure=True)
+    tmpdir.join('pages', 'home.js.coffee').write('', ensure=True)
+    tmpdir.join('pages', 'admin', 'users.js').write('', ensure=True)
+    tmpdir.join('shared', 'index.js').write('', ensure=True)
+    assets_dir = str(tmpdir) + '/'
+
+    (found, missing, cycles) = find_coffee_requirements.walk_requires(assets_dir, assets_dir + 'main.js')
+
+    assert found == ['vendor/jquery', 'shared/index', 'widgets/button', 'widgets/forms/input', 'pages/home']
+    assert missing == []
+
+
+def test_directory_index_is_bundled_once(tmpdir):
+    tmpdir.join('main.js').write('//= require shared\n//= require_tree .\n//= require_directory .\n')
+    tmpdir.join('shared', 'index.js').write('shared();\n', ensure=True)
+    tmpdir.join('app.js').write('app();\n')
+    assets_dir = str(tmpdir) + '/'
+
+    tree = find_coffee_requirements.AssetTree(assets_dir)
+    (filenames, missing, cycles) = find_coffee_requirements.bundle_manifest(tree, assets_dir + 'main.js')
+
+    assert filenames == [assets_dir + 'shared/index.js', assets_dir + 'app.js', assets_dir + 'main.js']
+    assert missing == []
+
+    (requires, _) = tree.requires(assets_dir + 'main.js', 'main')
+    assert requires == ['shared/index', 'app', 'shared/index', 'app']
+
+
+def test_write_bundle_concatenates_in_dependency_order(tmpdir):
+    tmpdir.join('main.js').write('//= require app\n//= require vendor/jquery\nmain();\n')
+    tmpdir.join('app.js').write('//= require vendor/jquery\napp();')
+    tmpdir.join('vendor', 'jquery.js').write('jquery();\n', ensure=True)
+    assets_dir = str(tmpdir) + '/'
+
+    tree = find_coffee_requirements.AssetTree(assets_dir)
+    (filenames, missing, cycles) = find_coffee_requirements.bundle_manifest(tree, assets_dir + 'main.js')
+
+    assert filenames == [assets_dir + 'vendor/jquery.js', assets_dir + 'app.js', assets_dir + 'main.js']
+
+    output = tmpdir.join('bundle.js')
+    size = find_coffee_requirements.write_bundle(filenames, str(output))
+
+    assert output.read() == 'jquery();\n//= require vendor/jquery\napp();\n//= require app\n//= require vendor/jquery\nmain();\n'
+    assert size == len(output.read())
+
+
+def test_write_bundle_refuses_files_that_need_compiling(tmpdir):
+    tmpdir.join('app.js.coffee').write('app()\n')
+
+    with pytest.raises(Exception):
+        find_coffee_requirements.write_bundle([str(tmpdir.join('app.js.coffee'))], str(tmpdir.join('bundle.js')))
+
+    assert not tmpdir.join('bundle.js').check()
+
+
+def test_require_index_is_never_written_inside_the_asset_dir(tmpdir):
+    write_asset(tmpdir, 'a')
+    assets_dir = str(tmpdir) + '/'
+
+    with pytest.raises(Exception):
+        find_coffee_requirements.save_require_index(assets_dir + 'a.js.coffee', {}, assets_dir)
+
+    assert tmpdir.join('a.js.coffee').read() == 'x = 1\n'
@@ -44,3 +44,18 @@ def test_spec_order_is_preserved(
 
     new_spec = json.loads(spec_file.read(), object_pairs_hook=OrderedDict)
     assert list(new_spec.keys()) == ['NoRedInk/spec-1', 'NoRedInk/spec-2', 'NoRedInk/top-1', 'NoRedInk/top-2', 'NoRedInk/top-3']
+
+
+def test_sync_many_versions_syncs_every_spec(tmpdir):
+    top_level_file = tmpdir.join('elm-native-package.json')
+    top_level_file.write(json.dumps(OrderedDict(top_level_deps)))
+
+    spec_files = [tmpdir.join('spec-{n}-elm-native-package.json'.format(n=n)) for n in range(3)]
+    for spec_file in spec_files:
+        spec_file.write(json.dumps(OrderedDict(spec_deps)))
+
+    native_deps_sync.sync_many_versions(str(top_level_file), list(map(str, spec_files)), jobs=2)
+
+    for spec_file in spec_files:
+        new_spec = json.loads(spec_file.read(), object_pairs_hook=OrderedDict)
+        assert list(new_spec.keys()) == ['NoRedInk/spec-1', 'NoRedInk/spec-2', 'NoRedInk/top-1', 'NoRedInk/top-2', 'NoRedInk/top-3']
@@ -1,32 +1,56 @@
+import io
 import json
 import tarfile
 import difflib
 import shutil
 
-import native_package_install
+import pytest
+import requests
 
+import native_package_install
 
-def test_main_does_not_download_twice_given_multiple_elm_packages(tmpdir, mocker):
-    native_elm_package = {'elm-lang/core': '1.0.0'}
-    native_elm_package_path = tmpdir.join('elm-native-package.json')
-    native_elm_package_path.write(json.dumps(native_elm_package))
 
-    fake_native_tarball_path = tmpdir.join('core.tgz')
+def _make_core_tarball(tmpdir, native=False):
+    """ a tarball of elm-lang/core 1.0.0, laid out the way github serves it """
+    tarball_path = tmpdir.join('core.tgz')
     with tmpdir.as_cwd():
-        with tarfile.open(str(fake_native_tarball_path), 'w') as f:
-            fake_elm_package = tmpdir.mkdir('core-1.0.0').join('elm-package.json')
-            fake_elm_package.write(json.dumps({
-                'source-directories': ['src', 'src2'],
-            }))
-            f.add(str(fake_elm_package.relto(tmpdir)))
+        package_root = tmpdir.mkdir('core-1.0.0')
+        package_root.join('elm-package.json').write(json.dumps({'source-directories': ['src']}))
+        if native:
+            package_root.join('src', 'Native', 'List.js').write('var _elm_lang$core$Native_List;', ensure=True)
+        with tarfile.open(str(tarball_path), 'w') as f:
+            f.add(str(package_root.relto(tmpdir)))
+    return tarball_path
 
-    elm_package_one_path = tmpdir.join('elm-package-one.json')
-    elm_package_one_path.write(json.dumps({
+
+def _make_install(tmpdir, mocker, native=False):
+    """
+    Writes a native manifest asking for elm-lang/core 1.0.0 and an elm-package.json to install it for,
+    and makes download serve the core tarball.
+    Returns the two manifest paths and the download mock.
+    """
+    native_elm_package_path = tmpdir.join('elm-native-package.json')
+    native_elm_package_path.write(json.dumps({'elm-lang/core': '1.0.0'}))
+
+    elm_package_path = tmpdir.join('elm-package.json')
+    elm_package_path.write(json.dumps({
         'repository': 'https://github.com/NoRedInk/elm-ops-tooling.git',
         'source-directories': ['.'],
         'dependencies': {},
     }))
 
+    tarball_path = _make_core_tarball(tmpdir, native=native)
+
+    def write_tarfile(_, tar_filename):
+        shutil.copyfile(str(tarball_path), tar_filename)
+
+    mock_download = mocker.patch.object(native_package_install, 'download', side_effect=write_tarfile)
+    return (native_elm_package_path, elm_package_path, mock_download)
+
+
+def test_main_does_not_download_twice_given_multiple_elm_packages(tmpdir, mocker):
+    (native_elm_package_path, elm_package_one_path, mock_download) = _make_install(tmpdir, mocker)
+
     elm_package_two_path = tmpdir.join('elm-package-two.json')
     elm_package_two_path.write(json.dumps({
         'repository': 'https://github.com/NoRedInk/elm-ops-tooling-two.git',
@@ -36,14 +60,6 @@ def test_main_does_not_download_twice_given_multiple_elm_packages(tmpdir, mocker
 
     vendor = tmpdir.mkdir('vendor')
 
-    def write_tarfile(_, tar_filename):
-        shutil.copyfile(str(fake_native_tarball_path), tar_filename)
-
-    mock_urlretrieve = mocker.patch.object(
-        native_package_install,
-        'urlretrieve',
-        side_effect=write_tarfile)
-
     run_install = lambda: native_package_install.main(
         str(native_elm_package_path),
         list(map(str, (elm_package_one_path, elm_package_two_path))),
@@ -52,7 +68,7 @@ def test_main_does_not_download_twice_given_multiple_elm_packages(tmpdir, mocker
     run_install()
     run_install()
 
-    assert mock_urlretrieve.call_count == 1
+    assert mock_download.call_count == 1
 
 
 def test_update_source_directories_makes_minimum_changes(tmpdir):
@@ -116,3 +132,316 @@ def test_update_source_directories_makes_minimum_changes(tmpdir):
             pass
         else:
             assert False, 'unexpected diff operator in: ' + diff
+
+
+def test_fetch_packages_with_jobs_downloads_each_package_once(tmpdir, mocker):
+    packages = [
+        {'owner': 'elm-lang', 'project': project, 'version': '1.0.0'}
+        for project in ('core', 'html', 'navigation', 'http')
+    ]
+    vendor = tmpdir.mkdir('vendor')
+
+    # built up front, as the downloads run on several threads at once
+    fake_tarball_paths = {}
+    for package in packages:
+        project = package['project']
+        fake_elm_package = tmpdir.mkdir(project + '-1.0.0').join('elm-package.json')
+        fake_elm_package.write(json.dumps({'source-directories': ['src']}))
+        fake_tarball_paths[project] = tmpdir.join(project + '.tgz')
+        with tarfile.open(str(fake_tarball_paths[project]), 'w') as f:
+            f.add(str(fake_elm_package), arcname=fake_elm_package.relto(tmpdir))
+
+    def write_tarfile(url, tar_filename):
+        shutil.copyfile(str(fake_tarball_paths[url.split('/')[4]]), tar_filename)
+
+    mock_download = mocker.patch.object(
+        native_package_install,
+        'download',
+        side_effect=write_tarfile)
+
+    native_package_install.fetch_packages(str(vendor), packages, jobs=3)
+
+    assert sorted(call[0][0] for call in mock_download.call_args_list) == sorted(
+        native_package_install.format_tarball_url(package) for package in packages)
+    for package in packages:
+        assert native_package_install.package_exists(str(vendor), package)
+
+
+def test_main_reuses_cached_tarball_after_vendor_dir_is_wiped(tmpdir, mocker):
+    (native_elm_package_path, elm_package_path, mock_download) = _make_install(tmpdir, mocker)
+
+    vendor = tmpdir.join('vendor')
+    cache = tmpdir.join('cache')
+
+    run_install = lambda offline: native_package_install.main(
+        str(native_elm_package_path),
+        [str(elm_package_path)],
+        str(vendor),
+        cache_dir=str(cache),
+        offline=offline)
+
+    run_install(False)
+    shutil.rmtree(str(vendor))
+    run_install(True)
+
+    assert mock_download.call_count == 1
+    assert vendor.join('elm-lang', 'core-1.0.0', 'elm-package.json').check()
+
+
+def test_offline_fetch_hashes_each_cached_tarball_once(tmpdir, mocker):
+    package = {'owner': 'elm-lang', 'project': 'core', 'version': '1.0.0'}
+    cache = str(tmpdir.join('cache'))
+
+    tarball_path = _make_core_tarball(tmpdir)
+    sha256 = native_package_install.file_sha256(str(tarball_path))
+    native_package_install.store_cached_tarball(cache, package, str(tarball_path))
+
+    spy = mocker.spy(native_package_install, 'file_sha256')
+    [fetched] = native_package_install.fetch_packages(
+        str(tmpdir.mkdir('vendor')), [dict(package)], cache_dir=cache, offline=True)
+
+    assert spy.call_count == 1
+    assert fetched['sha256'] == sha256
+    assert tmpdir.join('vendor', 'elm-lang', 'core-1.0.0', 'elm-package.json').check()
+
+
+def test_offline_fetch_fails_before_downloading_anything(tmpdir, mocker):
+    mock_download = mocker.patch.object(native_package_install, 'download')
+    packages = [{'owner': 'elm-lang', 'project': 'core', 'version': '1.0.0'}]
+
+    with pytest.raises(Exception) as error:
+        native_package_install.fetch_packages(
+            str(tmpdir.mkdir('vendor')), packages, cache_dir=str(tmpdir.join('cache')), offline=True)
+
+    assert 'elm-lang/core 1.0.0' in str(error.value)
+    assert mock_download.call_count == 0
+
+
+class FakeResponse(object):
+    """ a streamed requests response serving body, dropping the connection once after `fail_after` bytes """
+
+    def __init__(self, body, fail_after=None, status_code=200):
+        self.stream = io.BytesIO(body)
+        self.fail_after = fail_after
+        self.status_code = status_code
+        self.raw = self
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(response=self)
+
+    def read(self, size=None, decode_content=False):
+        if self.fail_after is not None and self.stream.tell() >= self.fail_after:
+            raise IOError('connection reset')
+        if self.fail_after is not None:
+            remaining = self.fail_after - self.stream.tell()
+            size = remaining if size is None else min(size, remaining)
+        return self.stream.read(size)
+
+    def close(self):
+        pass
+
+
+def test_stream_extracts_without_leaving_a_tarball(tmpdir, mocker):
+    tarball = io.BytesIO()
+    with tmpdir.as_cwd():
+        fake_elm_package = tmpdir.mkdir('core-1.0.0').join('elm-package.json')
+        fake_elm_package.write(json.dumps({'source-directories': ['src']}))
+        with tarfile.open(fileobj=tarball, mode='w:gz') as f:
+            f.add(str(fake_elm_package.relto(tmpdir)))
+
+    mock_get = mocker.patch.object(
+        native_package_install.http_client, 'get', return_value=FakeResponse(tarball.getvalue()))
+    vendor = tmpdir.mkdir('vendor')
+    package = {'owner': 'elm-lang', 'project': 'core', 'version': '1.0.0'}
+
+    native_package_install.fetch_packages(str(vendor), [package], stream=True)
+
+    assert mock_get.call_count == 1
+    assert vendor.join('elm-lang', 'core-1.0.0', 'elm-package.json').check()
+    assert vendor.join('elm-lang').listdir() == [vendor.join('elm-lang', 'core-1.0.0')]
+
+
+def test_selective_extraction_keeps_only_sources_and_native_code(tmpdir):
+    package_root = tmpdir.mkdir('core-1.0.0')
+    files = {
+        'LICENSE': 'BSD',
+        'app/Native/Early.js': 'var _elm_lang$core$Native_Early = {};',
+        'elm-package.json': json.dumps({'source-directories': ['src', 'app']}),
+        'src/List.elm': 'module List exposing (..)',
+        'src/Native/List.js': 'var _elm_lang$core$Native_List = {};',
+        'src/Native/README.md': 'notes',
+        'tests/Main.elm': 'module Main exposing (..)',
+    }
+    tarball = io.BytesIO()
+    with tmpdir.as_cwd():
+        with tarfile.open(fileobj=tarball, mode='w:gz') as f:
+            for (name, contents) in sorted(files.items()):
+                package_root.join(name).write(contents, ensure=True)
+                f.add(str(package_root.join(name).relto(tmpdir)))
+    tarball.seek(0)
+
+    vendor = tmpdir.mkdir('vendor')
+    native_package_install.extract_tar_stream(tarball, str(vendor), selective=True)
+
+    extracted = set(
+        path.relto(vendor.join('core-1.0.0')) for path in vendor.visit() if path.check(file=True))
+    assert extracted == set((
+        'elm-package.json',
+        'app/Native/Early.js',
+        'src/List.elm',
+        'src/Native/List.js',
+    ))
+
+
+def test_munge_names_only_rewrites_files_that_change(tmpdir):
+    vendor = tmpdir.mkdir('vendor')
+    native_dir = vendor.mkdir('elm-lang').mkdir('core-1.0.0').mkdir('src').mkdir('Native')
+    with_prefix = native_dir.join('List.js')
+    with_prefix.write('var _elm_lang$core$Native_List = function() {};')
+    without_prefix = native_dir.join('Utils.js')
+    without_prefix.write('var helpers = {};')
+    empty = native_dir.join('Empty.js')
+    empty.write('')
+    untouched_inode = without_prefix.stat().ino
+
+    changed = native_package_install.munge_names(
+        str(vendor),
+        'https://github.com/NoRedInk/elm-ops-tooling.git',
+        [{'owner': 'elm-lang', 'project': 'core', 'version': '1.0.0'}],
+        jobs=2)
+
+    assert changed == 1
+    assert with_prefix.read() == 'var _NoRedInk$elm_ops_tooling$Native_List = function() {};'
+    assert without_prefix.read() == 'var helpers = {};'
+    assert without_prefix.stat().ino == untouched_inode
+    assert empty.read() == ''
+
+
+def test_find_all_native_files_searches_source_dirs_once(tmpdir, mocker):
+    package_dir = tmpdir.mkdir('core-1.0.0')
+    package_dir.join('elm-package.json').write(json.dumps({'source-directories': ['src']}))
+    package_dir.join('src', 'Native', 'List.js').write('', ensure=True)
+    package_dir.join('src', 'Native', 'List', 'Sort.js').write('', ensure=True)
+    package_dir.join('src', 'List.js').write('', ensure=True)
+    package_dir.join('src', 'elm-stuff', 'Native', 'Stale.js').write('', ensure=True)
+    package_dir.join('examples', 'Native', 'Demo.js').write('', ensure=True)
+
+    expected = sorted([
+        str(package_dir.join('src', 'Native', 'List.js')),
+        str(package_dir.join('src', 'Native', 'List', 'Sort.js')),
+    ])
+    assert native_package_install.find_all_native_files(str(package_dir)) == expected
+
+    scan = mocker.spy(native_package_install, 'scan_native_files')
+    assert native_package_install.find_all_native_files(str(package_dir)) == expected
+    assert scan.call_count == 0
+
+
+def test_update_source_directories_reads_each_vendor_manifest_once(tmpdir, mocker):
+    vendor_dir = tmpdir.mkdir('vendor')
+    vendor_dir.join('elm-lang', 'core-1.0.0', 'elm-package.json').write(
+        json.dumps({'source-directories': ['src', 'src/']}), ensure=True)
+
+    elm_package_paths = []
+    for name in ('app', 'spec', 'storybook'):
+        elm_package_path = tmpdir.join(name, 'elm-package.json')
+        elm_package_path.write(json.dumps({
+            'repository': 'https://github.com/NoRedInk/{name}.git'.format(name=name),
+            'source-directories': ['.'],
+            'dependencies': {},
+        }), ensure=True)
+        elm_package_paths.append(str(elm_package_path))
+
+    load = mocker.spy(native_package_install.elm_package, 'load')
+
+    native_package_install.update_source_directories(
+        str(vendor_dir),
+        elm_package_paths,
+        [{'owner': 'elm-lang', 'project': 'core', 'version': '1.0.0'}],
+    )
+
+    assert load.call_count == len(elm_package_paths) + 1
+    for elm_package_path in elm_package_paths:
+        source_dirs = json.loads(open(elm_package_path).read())['source-directories']
+        assert source_dirs == ['.', '../vendor/elm-lang/core-1.0.0/src']
+
+
+def test_main_resumes_an_interrupted_install_without_downloading_again(tmpdir, mocker):
+    (native_elm_package_path, elm_package_path, _) = _make_install(tmpdir, mocker, native=True)
+
+    vendor = tmpdir.join('vendor')
+    run_install = lambda: native_package_install.main(
+        str(native_elm_package_path), [str(elm_package_path)], str(vendor))
+
+    mocker.patch.object(native_package_install, 'munge_names', side_effect=KeyboardInterrupt)
+    with pytest.raises(KeyboardInterrupt):
+        run_install()
+    mocker.stopall()
+
+    mock_download = mocker.patch.object(native_package_install, 'download')
+    munge_names = mocker.spy(native_package_install, 'munge_names')
+    run_install()
+
+    assert mock_download.call_count == 0
+    assert munge_names.call_count == 1
+    assert vendor.join('elm-lang', 'core-1.0.0', 'src', 'Native', 'List.js').read() == \
+        'var _NoRedInk$elm_ops_tooling$Native_List;'
+
+    run_install()
+    assert munge_names.call_count == 1
+
+
+def test_main_installs_again_a_package_whose_directory_was_deleted(tmpdir, mocker):
+    (native_elm_package_path, elm_package_path, mock_download) = _make_install(tmpdir, mocker, native=True)
+
+    vendor = tmpdir.join('vendor')
+    run_install = lambda: native_package_install.main(
+        str(native_elm_package_path), [str(elm_package_path)], str(vendor))
+
+    run_install()
+    shutil.rmtree(str(vendor.join('elm-lang', 'core-1.0.0')))
+    run_install()
+
+    assert mock_download.call_count == 2
+    assert vendor.join('elm-lang', 'core-1.0.0', 'src', 'Native', 'List.js').read() == \
+        'var _NoRedInk$elm_ops_tooling$Native_List;'
+
+
+def test_download_resumes_with_range_after_a_dropped_connection(tmpdir, mocker):
+    body = b'x' * 1000 + b'y' * 1000
+    ranges = []
+
+    def get(url, headers, stream):
+        requested_range = headers.get('Range')
+        ranges.append(requested_range)
+        if requested_range is None:
+            return FakeResponse(body, fail_after=1000)
+        offset = int(requested_range[len('bytes='):-1])
+        return FakeResponse(body[offset:], status_code=206)
+
+    mocker.patch.object(native_package_install.http_client, 'get', side_effect=get)
+    mocker.patch.object(native_package_install.time, 'sleep')
+
+    target = tmpdir.join('core-1.0.0-tar.gz')
+    native_package_install.download('https://example.com/core.tar.gz', str(target))
+
+    assert target.read_binary() == body
+    assert ranges == [None, 'bytes=1000-']
+    assert not tmpdir.join('core-1.0.0-tar.gz.part').check()
+
+
+def test_download_continues_a_partial_file_from_an_earlier_run(tmpdir, mocker):
+    body = b'0123456789'
+    tmpdir.join('core-1.0.0-tar.gz.part').write_binary(body[:4])
+
+    def get(url, headers, stream):
+        assert headers['Range'] == 'bytes=4-'
+        return FakeResponse(body)
+
+    mocker.patch.object(native_package_install.http_client, 'get', side_effect=get)
+
+    target = tmpdir.join('core-1.0.0-tar.gz')
+    native_package_install.download('https://example.com/core.tar.gz', str(target))
+
+    assert target.read_binary() == body
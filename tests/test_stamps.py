@@ -0,0 +1,36 @@
+import stamps
+
+
+def test_stamp_is_fresh_until_an_input_changes(tmpdir):
+    stamp_dir = str(tmpdir.mkdir('stamps'))
+    top_level = tmpdir.join('elm-package.json')
+    top_level.write('{"dependencies": {}}')
+    spec = tmpdir.join('spec-elm-package.json')
+    spec.write('{"dependencies": {}}')
+    files = [str(top_level), str(spec)]
+
+    assert not stamps.is_fresh('elm_deps_check', files, ['exact'], stamp_dir=stamp_dir)
+
+    stamps.record('elm_deps_check', files, ['exact'], stamp_dir=stamp_dir)
+    assert stamps.is_fresh('elm_deps_check', files, ['exact'], stamp_dir=stamp_dir)
+
+    # other options or tools have their own stamps
+    assert not stamps.is_fresh('elm_deps_check', files, ['package'], stamp_dir=stamp_dir)
+    assert not stamps.is_fresh('elm_deps_sync', files, ['exact'], stamp_dir=stamp_dir)
+
+    spec.write('{"dependencies": {"elm-lang/core": "5.0.0 <= v < 6.0.0"}}')
+    assert not stamps.is_fresh('elm_deps_check', files, ['exact'], stamp_dir=stamp_dir)
+
+
+def test_record_stamps_the_contents_hashed_before_the_check(tmpdir):
+    stamp_dir = str(tmpdir.mkdir('stamps'))
+    spec = tmpdir.join('elm-package.json')
+    spec.write('{"dependencies": {}}')
+    files = [str(spec)]
+
+    contents = stamps.contents_hash(files)
+    # edited while the check was running
+    spec.write('{"dependencies": {"elm-lang/core": "5.0.0 <= v < 6.0.0"}}')
+    stamps.record('elm_deps_check', files, ['exact'], stamp_dir=stamp_dir, contents=contents)
+
+    assert not stamps.is_fresh('elm_deps_check', files, ['exact'], stamp_dir=stamp_dir)
@@ -0,0 +1,18 @@
+import os
+
+import update_elm_package
+
+
+def test_upgrade_elm_files_only_rewrites_old_module_lines(tmpdir):
+    old = tmpdir.join('src', 'Old.elm')
+    old.write('module Old (view, update) where\n\nimport Html\n', ensure=True)
+    new = tmpdir.join('src', 'Nested', 'New.elm')
+    new.write('module Nested.New exposing (..)\n\n-- where the view goes\nview = 1\n', ensure=True)
+    os.utime(str(new), (0, 0))
+
+    rewritten = update_elm_package.upgrade_elm_files_in_folder('src', str(tmpdir), jobs=2)
+
+    assert rewritten == 1
+    assert old.read() == 'module Old exposing (view, update)\n\nimport Html\n'
+    assert new.read() == 'module Nested.New exposing (..)\n\n-- where the view goes\nview = 1\n'
+    assert new.mtime() == 0
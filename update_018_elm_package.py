@@ -2,9 +2,8 @@
 from __future__ import print_function
 
 import elm_deps_upgrade as upgrader
+import elm_package
 from collections import OrderedDict
-import json
-import requests
 import argparse
 import sys
 import re
@@ -21,16 +20,14 @@ def upgrade_elm_version(version):
     return "0.18.0 <= v < 0.19.0"
 
 def new_packages():
-    r = requests.get("http://package.elm-lang.org/new-packages")
-    return r.json()
+    return upgrader.cached_registry_get("http://package.elm-lang.org/new-packages", 'new-packages')
 
 def update_elm_package(root_folder, dry=False):
-    with open(root_folder + '/elm-package.json') as f:
-        package_data = json.load(f, object_pairs_hook=OrderedDict)
+    package_data = elm_package.ElmPackage.open(root_folder + '/elm-package.json')
 
     package_data['elm-version'] = upgrade_elm_version(package_data['elm-version'])
 
-    packages = package_data['dependencies']
+    packages = OrderedDict(package_data['dependencies'])
     upgraded_packages = new_packages()
 
     notes = []
@@ -49,7 +46,7 @@ def update_elm_package(root_folder, dry=False):
 
                 version = '1.0.0 <= v < 2.0.0'
                 upgradable_packages[new_name] = version
-                del package_data['dependencies'][package]
+                del packages[package]
 
             continue
 
@@ -71,13 +68,14 @@ def update_elm_package(root_folder, dry=False):
             update_to = upgrader.newest_version(suggestions)
         except Exception as e:
             notes.append('package {} already updated'.format(dep))
-            package_data['dependencies'][dep] = upgradable_packages[dep]
+            packages[dep] = upgradable_packages[dep]
             continue
 
         notes.append('updating {} to {}'.format(dep, update_to))
 
-        package_data['dependencies'][dep] = "{} <= v <= {}".format(update_to, update_to)
+        packages[dep] = "{} <= v <= {}".format(update_to, update_to)
 
+    package_data['dependencies'] = packages
 
     print('=======================')
     print('Notes:')
@@ -88,11 +86,10 @@ def update_elm_package(root_folder, dry=False):
     print('\n'.join(errors))
 
     print('========================\n\n')
-    print(json.dumps(package_data, sort_keys=False, indent=4))
+    print(package_data.render())
 
     if not dry:
-        with open(root_folder + '/elm-package.json', 'w') as f:
-            json.dump(package_data, f, sort_keys=False, indent=4)
+        package_data.save()
 
     if errors:
         print('There were errors that need to be handled manually!')
@@ -101,7 +98,7 @@ def update_elm_package(root_folder, dry=False):
 
 def upgrade_elm_files(root_folder):
     with open(root_folder + '/elm-package.json') as f:
-        package_data = json.load(f, object_pairs_hook=OrderedDict)
+        package_data = elm_package.load(f)
 
     dirs = package_data['source-directories']
 
@@ -2,14 +2,14 @@
 from __future__ import print_function
 
 import elm_deps_upgrade as upgrader
+import elm_package
 from collections import OrderedDict
-import json
-import requests
 import argparse
 import sys
 import re
 import os
 import glob
+from concurrent.futures import ProcessPoolExecutor
 
 module_ident = 'module'
 space_before_module_name = '\\s+'
@@ -31,6 +31,12 @@ module_pattern = ''.join(
         ]
         )
 
+# a module line that is already in 0.17 form
+upgraded_module_pattern = '^(port\\s+)?module\\s+\\S+\\s+exposing\\b'
+
+# how much of a file is read to tell whether it was already upgraded
+HEADER_SIZE = 8 * 1024
+
 KNOWN_MOVES = {
     'evancz/elm-html' : 'elm-lang/html'
     , 'evancz/virtual-dom': 'elm-lang/virtual-dom'
@@ -67,16 +73,14 @@ def get_module_name_and_exposing(text):
     return matches.groups()
 
 def new_packages():
-    r = requests.get("http://package.elm-lang.org/new-packages")
-    return r.json()
+    return upgrader.cached_registry_get("http://package.elm-lang.org/new-packages", 'new-packages')
 
 def update_elm_package(root_folder, dry=False):
-    with open(root_folder + '/elm-package.json') as f:
-        package_data = json.load(f, object_pairs_hook=OrderedDict)
+    package_data = elm_package.ElmPackage.open(root_folder + '/elm-package.json')
 
     package_data['elm-version'] = upgrade_elm_version(package_data['elm-version'])
 
-    packages = package_data['dependencies']
+    packages = OrderedDict(package_data['dependencies'])
     upgraded_packages = new_packages()
     print(upgraded_packages)
 
@@ -97,7 +101,7 @@ def update_elm_package(root_folder, dry=False):
 
                 version = '1.0.0 <= v <= 1.0.0'
                 upgradable_packages[new_name] = version
-                del package_data['dependencies'][package]
+                del packages[package]
 
             continue
 
@@ -119,13 +123,14 @@ def update_elm_package(root_folder, dry=False):
             update_to = upgrader.newest_version(suggestions)
         except Exception as e:
             notes.append('package {} already updated'.format(dep))
-            package_data['dependencies'][dep] = upgradable_packages[dep]
+            packages[dep] = upgradable_packages[dep]
             continue
 
         notes.append('updating {} to {}'.format(dep, update_to))
 
-        package_data['dependencies'][dep] = "{} <= v <= {}".format(update_to, update_to)
+        packages[dep] = "{} <= v <= {}".format(update_to, update_to)
 
+    package_data['dependencies'] = packages
 
     print('=======================')
     print('Notes:')
@@ -136,42 +141,64 @@ def update_elm_package(root_folder, dry=False):
     print('\n'.join(errors))
 
     print('========================\n\n')
-    print(json.dumps(package_data, sort_keys=False, indent=4))
+    print(package_data.render())
 
     if not dry:
-        with open(root_folder + '/elm-package.json', 'w') as f:
-            json.dump(package_data, f, sort_keys=False, indent=4)
+        package_data.save()
 
     if errors:
         print('There were errors that need to be handled manually!')
         sys.exit(1)
 
-def upgrade_elm_files_in_folder(folder, root_folder):
-    if folder[0] != '.':
-        folder = root_folder + '/' + folder
+def upgrade_elm_file(file):
+    """ upgrades the module line of a file, returning whether the file was rewritten.
+        Files that are already upgraded are told apart by their header, without reading the rest.
+    """
+    with open(file, 'r') as f:
+        header = f.read(HEADER_SIZE)
+
+        if re.search(upgraded_module_pattern, header, flags=re.MULTILINE):
+            return False
+
+        text = header + f.read()
 
-    for file in glob.glob('{}/**/*.elm'.format(folder), recursive=True):
-        with open(file, 'r') as f:
-            text = f.read()
+    (name, exposing) = get_module_name_and_exposing(text)
+    new_line = upgrade_module_syntax(name, exposing)
 
-        (name, exposing) = get_module_name_and_exposing(text)
-        new_line = upgrade_module_syntax(name, exposing)
+    new_text = replace_module_line(text, new_line)
+
+    if new_text == text:
+        return False
+
+    elm_package.write_atomically(file, new_text)
+    return True
+
+
+def upgrade_elm_files_in_folder(folder, root_folder, jobs=1):
+    """ upgrades every elm file in folder, over `jobs` processes. Returns how many files were rewritten """
+    if folder[0] != '.':
+        folder = root_folder + '/' + folder
 
-        new_text = replace_module_line(text, new_line)
+    files = sorted(glob.glob('{}/**/*.elm'.format(folder), recursive=True))
 
-        with open(file, 'w') as f:
-            f.write(new_text)
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            rewritten = list(executor.map(upgrade_elm_file, files, chunksize=max(1, len(files) // (jobs * 4))))
+    else:
+        rewritten = list(map(upgrade_elm_file, files))
 
+    return sum(rewritten)
 
 
-def upgrade_elm_files(root_folder):
+def upgrade_elm_files(root_folder, jobs=1):
     with open(root_folder + '/elm-package.json') as f:
-        package_data = json.load(f, object_pairs_hook=OrderedDict)
+        package_data = elm_package.load(f)
 
     dirs = package_data['source-directories']
 
     for dir in dirs:
-        upgrade_elm_files_in_folder(dir, root_folder)
+        rewritten = upgrade_elm_files_in_folder(dir, root_folder, jobs=jobs)
+        print('Upgraded {number} files in {dir}'.format(number=rewritten, dir=dir))
 
 def run_elm_make(root_folder):
     from subprocess import call
@@ -184,12 +211,13 @@ def main():
 
     parser = argparse.ArgumentParser(description='Automatically upgrade your package to 0.17')
     parser.add_argument('--dry', '-d', action='store_true', help='only print possible changes', default=False)
+    parser.add_argument('--jobs', '-j', type=int, help='how many processes to upgrade elm files with', default=1)
 
     parser.add_argument('package_dir')
     args = parser.parse_args()
 
     update_elm_package(args.package_dir, dry=args.dry)
-    upgrade_elm_files(args.package_dir)
+    upgrade_elm_files(args.package_dir, jobs=args.jobs)
     run_elm_make(args.package_dir)
 
 